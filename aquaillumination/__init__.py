@@ -1,32 +1,131 @@
 """The AquaIllumination Light component"""
+import asyncio
 from datetime import timedelta
 import logging
+import random
+import time
 import voluptuous as vol
 
-from homeassistant.const import CONF_HOST, CONF_NAME
+from homeassistant.const import (
+    CONF_HOST, CONF_MAC, CONF_NAME, EVENT_HOMEASSISTANT_CLOSE,
+    EVENT_HOMEASSISTANT_STOP)
 from homeassistant.helpers import discovery
 import homeassistant.helpers.config_validation as cv
-from homeassistant.util import Throttle, dt
+from homeassistant.helpers.dispatcher import (
+    async_dispatcher_connect, async_dispatcher_send)
+from homeassistant.core import callback
+from homeassistant.helpers.event import (
+    async_call_later, async_track_time_interval)
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt
 
+from .diagnostics import RefreshStats
+from .scan import async_scan, normalize_mac, validate_subnet
+from .schedule import AIScheduleModel
+from .stats import DiagnosticsView
+from .transition import AITransitionEngine
 
 REQUIREMENTS = ['AquaIPy==2.0.1']
 _LOGGER = logging.getLogger(__name__)
 
-ATTR_LAST_UPDATE = 'last_update'
+ATTR_COLORS = 'colors'
+ATTR_PRESET = 'preset'
+ATTR_TRANSITION = 'transition'
 DOMAIN = 'aquaillumination'
 DATA_INDEX = "data_" + DOMAIN
+SIGNAL_UPDATE_AI = DOMAIN + "_update_{}"
+SIGNAL_READY_AI = DOMAIN + "_ready_{}"
+DATA_STORE = "store_" + DOMAIN
+DATA_SESSION = "session_" + DOMAIN
+
+STORAGE_KEY = DOMAIN
+STORAGE_VERSION = 1
+STORAGE_SAVE_DELAY = 10
+
+CONF_SUBNET = 'subnet'
+
+
+def _validate_device_config(config):
+    """A light needs a host, or a MAC address and a subnet to find it in"""
+
+    if CONF_HOST not in config and CONF_SUBNET not in config:
+        raise vol.Invalid("Either host, or mac and subnet, are required")
+
+    return config
+
 
 CONFIG_SCHEMA = vol.Schema({
     DOMAIN: vol.All(
-        cv.ensure_list, [vol.Schema({
-            vol.Required(CONF_HOST): cv.string,
+        cv.ensure_list, [vol.All(vol.Schema({
+            vol.Optional(CONF_HOST): cv.string,
+            vol.Inclusive(CONF_MAC, 'discovery'): vol.All(
+                cv.string, normalize_mac),
+            vol.Inclusive(CONF_SUBNET, 'discovery'): validate_subnet,
             vol.Required(CONF_NAME): cv.string
-        })]
+        }), _validate_device_config)]
     )
 }, extra=vol.ALLOW_EXTRA)
 
 DEVICE_TYPES = ['light', 'switch', 'sensor']
+# Polling speeds up to SCAN_INTERVAL while the light is changing, and backs
+# off towards the max interval while the channel levels stay flat.
 SCAN_INTERVAL = timedelta(seconds=10)
+MAX_SCAN_INTERVAL = timedelta(minutes=5)
+MAX_MANUAL_SCAN_INTERVAL = timedelta(minutes=15)
+BRIGHTNESS_CHANGE_THRESHOLD = 0.1
+
+# While the schedule model can predict the channel levels, they are served
+# locally and the light is only polled to check for drift or an override.
+SCHEDULE_VERIFY_INTERVAL = timedelta(minutes=10)
+SCHEDULE_PREDICT_INTERVAL = timedelta(seconds=30)
+SCHEDULE_DRIFT_TOLERANCE = 2.0
+SCHEDULE_WRITE_HOLDOFF = timedelta(minutes=5)
+WRITE_COALESCE_DELAY = timedelta(milliseconds=250)
+
+# The lights have small embedded web servers, so keep a single persistent
+# connection open to each of them and reuse it for every request.
+CONNECTION_LIMIT = 20
+CONNECTION_LIMIT_PER_HOST = 1
+KEEPALIVE_TIMEOUT = timedelta(seconds=60)
+REQUEST_TIMEOUT = timedelta(seconds=10)
+
+# Lights that can't be reached are retried with exponential backoff, using a
+# short timeout for the first attempt after each backoff.
+RECONNECT_BACKOFF_MIN = timedelta(seconds=10)
+RECONNECT_BACKOFF_MAX = timedelta(minutes=10)
+PROBE_TIMEOUT = timedelta(seconds=3)
+
+# A light given by MAC address is only looked for again once it has failed
+# a few times in a row, and at most this often, as it may just be off.
+RESOLVE_AFTER_FAILURES = 3
+RESOLVE_MIN_INTERVAL = timedelta(minutes=30)
+
+SERVICE_SET_COLORS_BRIGHTNESS = 'set_colors_brightness'
+SERVICE_SAVE_PRESET = 'save_preset'
+SERVICE_APPLY_PRESET = 'apply_preset'
+SERVICE_DELETE_PRESET = 'delete_preset'
+
+COLORS_SCHEMA = vol.Schema({
+    cv.string: vol.All(vol.Coerce(float), vol.Range(min=0, max=100))
+})
+
+SET_COLORS_BRIGHTNESS_SCHEMA = vol.Schema({
+    vol.Required(CONF_HOST): cv.string,
+    vol.Required(ATTR_COLORS): COLORS_SCHEMA,
+    vol.Optional(ATTR_TRANSITION): vol.All(
+        vol.Coerce(float), vol.Range(min=0, max=6553))
+})
+
+SAVE_PRESET_SCHEMA = vol.Schema({
+    vol.Required(CONF_HOST): cv.string,
+    vol.Required(ATTR_PRESET): cv.string,
+    vol.Optional(ATTR_COLORS): COLORS_SCHEMA
+})
+
+PRESET_SCHEMA = vol.Schema({
+    vol.Required(CONF_HOST): cv.string,
+    vol.Required(ATTR_PRESET): cv.string
+})
 
 
 async def async_setup(hass, hass_config):
@@ -35,56 +134,493 @@ async def async_setup(hass, hass_config):
     if DATA_INDEX not in hass.data:
         hass.data[DATA_INDEX] = {}
 
+    if DATA_STORE not in hass.data:
+        store = AIDeviceStore(hass)
+        await store.async_load()
+        hass.data[DATA_STORE] = store
+
+    if DATA_SESSION not in hass.data:
+        hass.data[DATA_SESSION] = AISession(hass)
+
+    # Devices connect in the background, so setup doesn't wait on any of
+    # the lights. Entities are built from the metadata cached by the last
+    # run, or once the device has connected for the first time.
+    unresolved = {}
+
     for config in hass_config.get(DOMAIN, []):
-        await _async_setup_ai_device(hass, hass_config, config)
+        device = _async_setup_ai_device(hass, config)
+
+        if device is None:
+            continue
+
+        if device.host is None:
+            unresolved.setdefault(config[CONF_SUBNET], []).append(device)
+        else:
+            device.async_start()
+
+    if unresolved:
+        hass.async_create_task(_async_find_devices(hass, unresolved))
 
     for device in DEVICE_TYPES:
         hass.async_create_task(discovery.async_load_platform(
-            hass, device, DOMAIN, config, hass_config))
+            hass, device, DOMAIN, {}, hass_config))
+
+    _async_register_services(hass)
+    hass.http.register_view(DiagnosticsView(DOMAIN, hass.data[DATA_INDEX]))
 
     return True
 
 
-async def _async_setup_ai_device(hass, hass_config, config):
-    """Setup an individual device"""
+def _async_register_services(hass):
+    """Register the multi-channel and preset services"""
 
-    host = config.get(CONF_HOST)
+    def get_device(call):
+
+        host = call.data[CONF_HOST]
+        mac = normalize_mac(host)
+        device = hass.data[DATA_INDEX].get(host) or \
+            hass.data[DATA_INDEX].get(mac)
+
+        # Any light can also be given by its current host, or its MAC
+        # address, however it was configured.
+        if device is None:
+            device = next(
+                (device for device in hass.data[DATA_INDEX].values()
+                 if device.host == host or (device.mac_addr is not None and
+                                            normalize_mac(device.mac_addr) ==
+                                            mac)),
+                None)
+
+        if device is None:
+            _LOGGER.error("No AquaIllumination device with host %s",
+                          call.data[CONF_HOST])
+
+        return device
+
+    async def async_set_colors_brightness(call):
+        """Set one or more channels, in a single write"""
+
+        device = get_device(call)
+
+        if device is not None:
+            await device.async_set_colors(
+                call.data[ATTR_COLORS], call.data.get(ATTR_TRANSITION))
+
+    async def async_save_preset(call):
+        """Store the given or current channel levels as a named preset"""
+
+        device = get_device(call)
+
+        if device is not None:
+            device.async_save_preset(
+                call.data[ATTR_PRESET], call.data.get(ATTR_COLORS))
+
+    async def async_apply_preset(call):
+        """Apply a named preset, in a single write"""
+
+        device = get_device(call)
+
+        if device is not None:
+            await device.async_apply_preset(call.data[ATTR_PRESET])
+
+    async def async_delete_preset(call):
+        """Remove a named preset"""
+
+        device = get_device(call)
+
+        if device is not None:
+            device.async_delete_preset(call.data[ATTR_PRESET])
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_SET_COLORS_BRIGHTNESS, async_set_colors_brightness,
+        schema=SET_COLORS_BRIGHTNESS_SCHEMA)
+    hass.services.async_register(
+        DOMAIN, SERVICE_SAVE_PRESET, async_save_preset,
+        schema=SAVE_PRESET_SCHEMA)
+    hass.services.async_register(
+        DOMAIN, SERVICE_APPLY_PRESET, async_apply_preset,
+        schema=PRESET_SCHEMA)
+    hass.services.async_register(
+        DOMAIN, SERVICE_DELETE_PRESET, async_delete_preset,
+        schema=PRESET_SCHEMA)
+
+
+@callback
+def _async_setup_ai_device(hass, config):
+    """Setup an individual device, returns None if it's already set up"""
+
+    mac = config.get(CONF_MAC)
+    key = mac or config[CONF_HOST]
     name = config.get(CONF_NAME)
 
-    if host in hass.data[DATA_INDEX]:
+    if key in hass.data[DATA_INDEX]:
+        return None
+
+    # The configured host, or where the light was last seen
+    host = config.get(CONF_HOST)
+
+    if host is None:
+        host = hass.data[DATA_STORE].get_host_for_mac(mac)
+
+    device = AIData(hass, host, name, SCAN_INTERVAL, hass.data[DATA_STORE],
+                    hass.data[DATA_SESSION], mac, config.get(CONF_SUBNET))
+    hass.data[DATA_INDEX][key] = device
+
+    return device
+
+
+async def _async_find_devices(hass, unresolved):
+    """Look for lights that haven't been seen before, then start them.
+
+    One sweep of each subnet finds all of the lights on it. Any that aren't
+    found are started anyway, and keep looking for themselves as they retry.
+    """
+
+    found = {}
+
+    for hosts in await asyncio.gather(*[
+            async_scan(subnet, [device.mac for device in devices])
+            for subnet, devices in unresolved.items()]):
+        found.update(hosts)
+
+    for devices in unresolved.values():
+        for device in devices:
+            device.async_record_scan()
+
+            if device.mac in found:
+                device.async_set_host(found[device.mac])
+
+            device.async_start()
+
+
+@callback
+def async_when_ready(hass, device, action):
+    """Call action with a device, now or once its metadata is first known"""
+
+    if device.ready:
+        action(device)
         return
 
-    # Setup connection with devices
-    device = AIData(host, name, SCAN_INTERVAL)
-    
-    await device.async_update()
-    hass.data[DATA_INDEX][host] = device
+    unsub = None
+
+    @callback
+    def async_handle_ready():
+        """Run the action once, when the device first connects"""
+
+        unsub()
+        action(device)
+
+    unsub = async_dispatcher_connect(
+        hass, device.ready_signal, async_handle_ready)
+
+
+class AIDeviceStore:
+    """Persisted device metadata, keyed by MAC address.
+
+    Lets the platforms build their entities on a restart, without having to
+    wait for the device to answer.
+    """
+
+    def __init__(self, hass):
+
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._devices = {}
+        self._save_pending = False
+
+    async def async_load(self):
+        """Load the stored metadata from disk"""
+
+        data = await self._store.async_load()
+
+        if data is not None:
+            self._devices = data.get('devices', {})
+
+    def get(self, mac_addr):
+        """Get the stored metadata for a device"""
+
+        return self._devices.get(mac_addr)
+
+    def get_mac_for_host(self, host):
+        """Get the MAC address last seen at the given host"""
+
+        for mac_addr, device in self._devices.items():
+            if device.get('host') == host:
+                return mac_addr
+
+        return None
+
+    def get_mac(self, mac):
+        """Get the stored MAC address matching a (normalized) one"""
+
+        for mac_addr in self._devices:
+            if normalize_mac(mac_addr) == mac:
+                return mac_addr
+
+        return None
+
+    def get_host_for_mac(self, mac):
+        """Get the host a light was last seen at, by (normalized) MAC"""
+
+        mac_addr = self.get_mac(mac)
+
+        if mac_addr is None:
+            return None
+
+        return self._devices[mac_addr].get('host')
+
+    def async_update(self, mac_addr, **kwargs):
+        """Update the metadata for a device and schedule a save"""
+
+        self._devices.setdefault(mac_addr, {}).update(kwargs)
+
+        # Only the first change arms the save, later ones are picked up by
+        # it, so a steady stream of updates can't keep pushing it back.
+        if not self._save_pending:
+            self._save_pending = True
+            self._store.async_delay_save(
+                self._data_to_save, STORAGE_SAVE_DELAY)
+
+    def _data_to_save(self):
+
+        self._save_pending = False
+
+        return {'devices': self._devices}
+
+
+class AISession:
+    """Pooled keep-alive HTTP session, shared by all the AI devices.
+
+    Also counts the connections created and reused, and the body bytes sent
+    and received, for each host.
+    """
+
+    def __init__(self, hass):
+
+        import aiohttp
+
+        self.connections_created = {}
+        self.connections_reused = {}
+        self.bytes_sent = {}
+        self.bytes_received = {}
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_create_end.append(self._on_create)
+        trace_config.on_connection_reuseconn.append(self._on_reuse)
+        trace_config.on_request_chunk_sent.append(self._on_chunk_sent)
+        trace_config.on_response_chunk_received.append(
+            self._on_chunk_received)
+
+        connector = aiohttp.TCPConnector(
+            limit=CONNECTION_LIMIT,
+            limit_per_host=CONNECTION_LIMIT_PER_HOST,
+            keepalive_timeout=KEEPALIVE_TIMEOUT.total_seconds(),
+            enable_cleanup_closed=True)
+
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=REQUEST_TIMEOUT.total_seconds()),
+            trace_configs=[trace_config])
+
+        hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_CLOSE, self._async_close)
+
+    async def _async_close(self, event):
+        """Close the session, when Home Assistant shuts down"""
+
+        await self.session.close()
+
+    @staticmethod
+    async def _on_request_start(session, context, params):
+
+        host = params.url.host
+
+        if params.url.port not in (None, 80):
+            host = "{0}:{1}".format(host, params.url.port)
+
+        context.host = host
+
+    async def _on_create(self, session, context, params):
+
+        host = context.host
+        self.connections_created[host] = \
+            self.connections_created.get(host, 0) + 1
+
+    async def _on_reuse(self, session, context, params):
+
+        host = context.host
+        self.connections_reused[host] = \
+            self.connections_reused.get(host, 0) + 1
+
+    async def _on_chunk_sent(self, session, context, params):
+
+        host = context.host
+        self.bytes_sent[host] = \
+            self.bytes_sent.get(host, 0) + len(params.chunk)
+
+    async def _on_chunk_received(self, session, context, params):
+
+        host = context.host
+        self.bytes_received[host] = \
+            self.bytes_received.get(host, 0) + len(params.chunk)
+
+
+class AICircuitBreaker:
+    """Reconnect state for a device, with exponential backoff and jitter.
+
+    While the breaker is open the device is known to be down, and no network
+    calls should be made. Once the backoff has passed it is half-open, and a
+    single quick probe is allowed through, to check if it has recovered.
+    """
+
+    def __init__(self):
+
+        self.failures = 0
+        self._retry_at = None
+
+    @property
+    def is_open(self):
+
+        return self._retry_at is not None and time.monotonic() < self._retry_at
+
+    @property
+    def is_half_open(self):
+
+        return self.failures > 0 and not self.is_open
+
+    def record_success(self):
+        """Close the breaker, after a successful call"""
+
+        self.failures = 0
+        self._retry_at = None
+
+    def record_failure(self):
+        """Open the breaker, returns the backoff in seconds"""
+
+        self.failures += 1
+
+        backoff = min(
+            RECONNECT_BACKOFF_MIN.total_seconds() * 2 ** (self.failures - 1),
+            RECONNECT_BACKOFF_MAX.total_seconds())
+
+        # Jitter, so lights that went down together don't retry together
+        backoff *= random.uniform(0.5, 1)
+
+        self._retry_at = time.monotonic() + backoff
+
+        return backoff
 
 
 class AIData:
-    """Class for handling data from AI devices and caching."""
+    """Coordinator for an AI device, fetches data and pushes it to entities.
+
+    A single timer per device drives the refresh, entities subscribe to the
+    update signal instead of polling the device themselves.
+    """
 
-    def __init__(self, host, name, throttle):
+    def __init__(self, hass, host, name, throttle, store, session, mac=None,
+                 subnet=None):
 
         from aquaipy import AquaIPy
 
-        self.attr = {}
+        self._hass = hass
+        self._store = store
+        self._session = session
         self._connected = False
-        self._device = AquaIPy(name)
+        self._breaker = AICircuitBreaker()
+        self._device = AquaIPy(name, session=session.session, loop=hass.loop)
         self._t = throttle
+        self._poll_interval = throttle
         self._colors_brightness = None
         self._schedule_state = None
+        self._last_update = None
         self._host = host
+        self._mac = mac
+        self._key = mac or host
+        self._subnet = subnet
+        self._resolving = None
+        self._last_resolve = None
+        self._lock = asyncio.Lock()
+        self._unsub_refresh = None
+        self._refresh_due = None
+        self._unsub_predict = None
+        self._unsub_stop = None
+        self._last_write = None
+        self._predicting = False
+
+        self.setup_latency = None
+        self.stats = RefreshStats()
+
+        # Channel changes waiting to be merged into the next set call
+        self._pending_colors = {}
+        self._pending_write = None
+        self._transitions = AITransitionEngine(hass, self._async_queue_write)
+
+        # Channel list and model info, fetched once at connect time. Seeded
+        # from the last run, so entities can be built before connecting.
+        if mac is not None:
+            self._mac_addr = store.get_mac(mac)
+        else:
+            self._mac_addr = store.get_mac_for_host(host)
 
-        self.async_update = Throttle(throttle)(self._async_update)
+        self._colors = None
+        self._product_type = None
+        self._firmware_version = None
+        self._schedule_model = AIScheduleModel()
+
+        if self._mac_addr is not None:
+            cached = store.get(self._mac_addr)
+            self._colors = cached.get('colors')
+            self._product_type = cached.get('product_type')
+            self._firmware_version = cached.get('firmware_version')
+            self._schedule_model = AIScheduleModel(cached.get('schedule'))
+
+            # Last known state, shown until the first connect attempt
+            self._colors_brightness = cached.get('colors_brightness')
+            self._schedule_state = cached.get('schedule_state')
 
     @property
     def name(self):
         return self._device.name
 
+    @property
+    def mac(self):
+        """Configured (normalized) MAC address, used to find the device"""
+
+        return self._mac
+
     @property
     def mac_addr(self):
-        return self._device.mac_addr
+        return self._mac_addr
+
+    @property
+    def ready(self):
+        """Check if the channel list and MAC address are known"""
+
+        return self._colors is not None and self._mac_addr is not None
+
+    @property
+    def host(self):
+        """Current host of the device, may change if it has a subnet"""
+
+        return self._host
+
+    @property
+    def colors(self):
+        """List of color channels for this device"""
+
+        return self._colors
+
+    @property
+    def product_type(self):
+
+        return self._product_type
+
+    @property
+    def firmware_version(self):
+
+        return self._firmware_version
     
     @property
     def connected(self):
@@ -106,31 +642,702 @@ class AIData:
 
         return self._schedule_state
 
+    @property
+    def last_update(self):
+        """Time of the last successful fetch from the device"""
+
+        return self._last_update
+
+    @property
+    def available(self):
+        """Return if the device has been refreshed recently"""
+
+        # Restored state is shown until the first attempt to connect fails
+        if self._last_update is None:
+            return self._colors_brightness is not None and \
+                self._breaker.failures == 0
+
+        if not self._connected:
+            return False
+
+        return (dt.utcnow() - self._last_update) < (3 * self._poll_interval)
+
     @property
     def throttle(self):
 
         return self._t
 
-    async def _async_update(self):
+    @property
+    def poll_interval(self):
+        """Current interval between refreshes, adapts to the light's activity"""
 
-        if not self.connected:
-            from aquaipy.error import FirmwareError, ConnError, MustBeParentError
-            
-            try:
-                await self._device.async_connect(self._host)
-            except FirmwareError:
-                _LOGGER.error("Invalid firmware version for target device")
-                return
-            except ConnError:
-                _LOGGER.error("Unable to connect to specified device, please verify the host name")
-                return
-            except MustBeParentError:
-                _LOGGER.error("The specifed device must be the parent light, if paired. Please verify")
+        return self._poll_interval
+
+    @property
+    def connections_created(self):
+        """Number of new HTTP connections opened to this device"""
+
+        return self._session.connections_created.get(self._host, 0)
+
+    @property
+    def connections_reused(self):
+        """Number of requests that reused an open HTTP connection"""
+
+        return self._session.connections_reused.get(self._host, 0)
+
+    def diagnostics(self):
+        """Get the connection and refresh statistics for this device"""
+
+        return {
+            'name': self.name,
+            'mac_addr': self._mac_addr,
+            'connected': self._connected,
+            'poll_interval': self._poll_interval.total_seconds(),
+            'setup_latency': self.setup_latency,
+            'reconnect_failures': self._breaker.failures,
+            'connections_created': self.connections_created,
+            'connections_reused': self.connections_reused,
+            'bytes_sent': self._session.bytes_sent.get(self._host, 0),
+            'bytes_received': self._session.bytes_received.get(self._host, 0),
+            'refresh': self.stats.as_dict()
+        }
+
+    @property
+    def update_signal(self):
+        """Dispatcher signal sent after each refresh of this device"""
+
+        return SIGNAL_UPDATE_AI.format(self._key)
+
+    @property
+    def ready_signal(self):
+        """Dispatcher signal sent when the metadata is first known"""
+
+        return SIGNAL_READY_AI.format(self._key)
+
+    def async_start(self):
+        """Start the refresh timer, connecting in the background"""
+
+        if self._unsub_stop is not None:
+            return
+
+        self._unsub_stop = self._hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_STOP, self._async_handle_stop)
+        self._unsub_predict = async_track_time_interval(
+            self._hass, self._async_handle_predict, SCHEDULE_PREDICT_INTERVAL)
+        self._hass.async_create_task(self._async_connect())
+
+    async def _async_connect(self):
+        """Take the first reading, then carry on with the refresh timer"""
+
+        start = time.monotonic()
+
+        await self._async_handle_interval(None)
+
+        self.setup_latency = time.monotonic() - start
+
+        if self._last_update is not None:
+            _LOGGER.info("Connected to %s (%s) in %.2fs", self.name,
+                         self._host, self.setup_latency)
+
+    @callback
+    def _async_schedule_refresh(self):
+        """(Re)schedule the next refresh, after the current poll interval.
+
+        A refresh that is already due sooner is left alone, so a run of
+        writes, e.g. a transition, can't keep pushing it back.
+        """
+
+        if self._unsub_stop is None:
+            return
+
+        due = time.monotonic() + self._poll_interval.total_seconds()
+
+        if self._unsub_refresh is not None:
+            if self._refresh_due <= due:
                 return
 
+            self._unsub_refresh()
+
+        self._refresh_due = due
+        self._unsub_refresh = async_call_later(
+            self._hass, self._poll_interval.total_seconds(),
+            self._async_handle_interval)
+
+    async def _async_handle_interval(self, now):
+        """Refresh the device, when the timer fires"""
+
+        self._unsub_refresh = None
+
+        # Always re-arm, or one bad refresh would stop polling for good
+        try:
+            await self.async_refresh()
+        finally:
+            self._async_schedule_refresh()
+
+    @callback
+    def _async_handle_predict(self, now):
+        """Serve the channel levels predicted by the schedule model"""
+
+        if not self._predicting or self._lock.locked():
+            return
+
+        if self._recently_written():
+            return
+
+        predicted = self._schedule_model.predict(dt.now())
+
+        if predicted is None:
+            # The model doesn't cover this time of day, go back to polling
+            self._predicting = False
+            self._poll_interval = self._t
+            self._async_schedule_refresh()
+            return
+
+        current = self._colors_brightness or {}
+
+        if all(abs(val - current.get(color, -1)) < 0.01
+               for color, val in predicted.items()):
+            return
+
+        self._colors_brightness = predicted
+        async_dispatcher_send(self._hass, self.update_signal)
+
+    async def _async_handle_stop(self, event):
+        """Stop the refresh timer, when Home Assistant shuts down"""
+
+        self._unsub_stop = None
+        self.async_stop()
+
+    def async_stop(self):
+        """Stop the refresh timer, and any transitions, for this device"""
+
+        self._transitions.cancel()
+
+        if self._unsub_refresh is not None:
+            self._unsub_refresh()
+            self._unsub_refresh = None
+
+        if self._unsub_predict is not None:
+            self._unsub_predict()
+            self._unsub_predict = None
+
+        if self._unsub_stop is not None:
+            self._unsub_stop()
+            self._unsub_stop = None
+
+    async def async_refresh(self):
+        """Fetch the latest data once and notify all subscribed entities"""
+
+        # A refresh that is already in flight will deliver fresh data, so
+        # don't queue up a second one behind it.
+        if self._lock.locked():
+            self.stats.throttled += 1
+            return
+
+        async with self._lock:
+            await self._async_update()
+
+        _LOGGER.debug("%s connections: %d created, %d reused", self.name,
+                      self.connections_created, self.connections_reused)
+
+        # The entities update synchronously, so this is loop time too
+        start = time.monotonic()
+        async_dispatcher_send(self._hass, self.update_signal)
+        self.stats.blocked += time.monotonic() - start
+
+    @property
+    def presets(self):
+        """Named presets stored for this device"""
+
+        if self._mac_addr is None:
+            return {}
+
+        cached = self._store.get(self._mac_addr) or {}
+
+        return cached.get('presets', {})
+
+    async def async_set_colors(self, colors, transition=None):
+        """Set a full or partial map of channels, in a single write"""
+
+        if self._colors is None:
+            _LOGGER.error("Channels for %s are not known yet", self.name)
+            return None
+
+        unknown = set(colors) - set(self._colors)
+
+        if unknown:
+            _LOGGER.error("Unknown channels for %s: %s",
+                          self.name, ", ".join(sorted(unknown)))
+            return None
+
+        return await self.async_set_colors_brightness(colors, transition)
+
+    def async_save_preset(self, preset, colors=None):
+        """Store a named preset, defaults to the current channel levels"""
+
+        if colors is None:
+            colors = self._colors_brightness
+
+        if colors is None or self._mac_addr is None:
+            _LOGGER.error("No channel levels to save as preset %s for %s",
+                          preset, self.name)
+            return
+
+        presets = dict(self.presets)
+        presets[preset] = dict(colors)
+        self._store.async_update(self._mac_addr, presets=presets)
+
+    def async_delete_preset(self, preset):
+        """Remove a named preset"""
+
+        if preset not in self.presets:
+            _LOGGER.error("No preset %s for %s", preset, self.name)
+            return
+
+        presets = dict(self.presets)
+        del presets[preset]
+        self._store.async_update(self._mac_addr, presets=presets)
+
+    async def async_apply_preset(self, preset):
+        """Apply a named preset, in a single write"""
+
+        if preset not in self.presets:
+            _LOGGER.error("No preset %s for %s", preset, self.name)
+            return None
+
+        return await self.async_set_colors(self.presets[preset])
+
+    async def async_set_colors_brightness(self, colors, transition=None):
+        """Change the brightness of one or more channels.
+
+        With a transition, the channels are ramped to their new levels by
+        the transition engine, and this returns once the ramp has started.
+        Without one, any ramps of the channels are stopped and the change is
+        queued.
+        """
+
+        if transition:
+            self._transitions.start(
+                colors, transition, self._colors_brightness or {})
+            return None
+
+        self._transitions.cancel(colors)
+
+        return await self._async_queue_write(colors)
+
+    async def _async_queue_write(self, colors):
+        """Queue a brightness change for one or more channels.
+
+        Changes that arrive within WRITE_COALESCE_DELAY of each other are
+        merged into a single set call, so a scene changing every channel
+        results in one write to the device.
+        """
+
+        self._pending_colors.update(colors)
+
+        if self._pending_write is None:
+            self._pending_write = self._hass.loop.create_future()
+            async_call_later(
+                self._hass, WRITE_COALESCE_DELAY.total_seconds(),
+                self._async_flush_writes)
+
+        return await asyncio.shield(self._pending_write)
+
+    async def _async_flush_writes(self, now=None):
+        """Send all queued channel changes to the device, in one write"""
+
+        colors = self._pending_colors
+        pending_write = self._pending_write
+        self._pending_colors = {}
+        self._pending_write = None
+
+        try:
+            async with self._lock:
+                result = await self._async_write_colors(colors)
+        except Exception as err:
+            pending_write.set_exception(err)
+            return
+
+        pending_write.set_result(result)
+
+    async def _async_write_colors(self, colors):
+        """Merge the changes into the cached brightness and write them.
+
+        The merge is done on the cache, but AquaIPy still reads the levels
+        back before every set, so each write is a GET and a POST.
+        """
+
+        import aiohttp
+        from aquaipy import Response
+        from aquaipy.error import Error
+
+        if self._breaker.is_open or not self.connected:
+            _LOGGER.error("Unable to set colors brightness for %s, "
+                          "the device is not connected", self.name)
+            return Response.Error
+
+        try:
+            return await self._async_write_merged_colors(colors)
+        except (Error, aiohttp.ClientError, asyncio.TimeoutError) as err:
+            self._handle_failure(err)
+            async_dispatcher_send(self._hass, self.update_signal)
+            return Response.Error
+
+    async def _async_write_merged_colors(self, colors):
+
+        from aquaipy import Response
+
+        if self._colors_brightness is None:
+            self._colors_brightness = \
+                await self._device.async_get_colors_brightness()
+
+        colors_pct = {}
+
+        for color, val in self._colors_brightness.items():
+
+            # For the moment we don't support HD mode, for these lights. This
+            # means that we limit all channels to a max of 100%, when setting
+            # the brightness. The next part works around that, until this
+            # support is added.
+
+            colors_pct[color] = min(val, 100)
+
+        colors_pct.update(colors)
+
+        _LOGGER.debug("Setting colors brightness: %s", colors_pct)
+        result = await self._device.async_set_colors_brightness(colors_pct)
+
+        if result != Response.Success:
+            _LOGGER.error(
+                "Unable to set colors brightness for %s: %s", self.name, result)
+            return result
+
+        # Keep the cache in line with the device, so the next batch of
+        # changes is built on top of this one, and show the change at once.
+        previous = self._colors_brightness
+        self._colors_brightness = colors_pct
+        self._last_write = time.monotonic()
+        self._predicting = False
+        self._save_snapshot(previous, self._schedule_state)
+
+        # Without a schedule the light keeps what it's told, so there is no
+        # need for a confirming poll. Under one it may take back over.
+        if self._schedule_state:
+            self._poll_interval = self._t
+            self._async_schedule_refresh()
+
+        async_dispatcher_send(self._hass, self.update_signal)
+
+        return result
+
+    async def async_set_schedule_state(self, enable):
+        """Enable or disable the schedule, updating the cached state at once"""
+
+        import aiohttp
+        from aquaipy import Response
+        from aquaipy.error import Error
+
+        if self._breaker.is_open or not self.connected:
+            _LOGGER.error("Unable to set schedule state for %s, "
+                          "the device is not connected", self.name)
+            return Response.Error
+
+        try:
+            async with self._lock:
+                result = await self._device.async_set_schedule_state(enable)
+        except (Error, aiohttp.ClientError, asyncio.TimeoutError) as err:
+            self._handle_failure(err)
+            async_dispatcher_send(self._hass, self.update_signal)
+            return Response.Error
+
+        if result != Response.Success:
+            _LOGGER.error(
+                "Unable to set schedule state for %s: %s", self.name, result)
+            return result
+
+        previous = self._schedule_state
+        self._schedule_state = enable
+        self._save_snapshot(self._colors_brightness, previous)
+
+        if enable:
+            # The light jumps to its schedule, poll to pick up the levels
+            self._poll_interval = self._t
+            self._async_schedule_refresh()
+        else:
+            self._predicting = False
+
+        async_dispatcher_send(self._hass, self.update_signal)
+
+        return result
+
+    def _recently_written(self):
+        """Check if the channels were set by us, a short while ago"""
+
+        return self._last_write is not None and \
+            time.monotonic() - self._last_write < \
+            SCHEDULE_WRITE_HOLDOFF.total_seconds()
+
+    def _update_schedule_model(self):
+        """Check a live reading against the schedule model, then learn it"""
+
+        now = dt.now()
+        live = self._colors_brightness
+
+        # Levels we have set ourselves are an override, not the schedule
+        if not self._schedule_state or live is None or \
+                self._recently_written():
+            self._predicting = False
+            return
+
+        predicted = self._schedule_model.predict(now)
+
+        drifted = predicted is not None and any(
+            abs(val - predicted.get(color, val)) > SCHEDULE_DRIFT_TOLERANCE
+            for color, val in live.items())
+
+        # Only the points around now are relearned, the rest still hold
+        if drifted:
+            _LOGGER.debug("%s has drifted from its schedule model, "
+                          "relearning this part of it", self.name)
+            self._schedule_model.forget(now)
+
+        added = self._schedule_model.record(now, live)
+        self._predicting = self._schedule_model.predict(now) is not None
+
+        # Only stored when the model changes shape, not on every reading
+        if (added or drifted) and self._mac_addr is not None:
+            self._store.async_update(
+                self._mac_addr, schedule=self._schedule_model.as_dict())
+
+    def _save_snapshot(self, previous, previous_schedule_state):
+        """Persist the channel levels and schedule state, if they changed"""
+
+        if self._mac_addr is None:
+            return
+
+        if previous == self._colors_brightness and \
+                previous_schedule_state == self._schedule_state:
+            return
+
+        self._store.async_update(
+            self._mac_addr,
+            colors_brightness=self._colors_brightness,
+            schedule_state=self._schedule_state)
+
+    def _next_poll_interval(self, previous):
+        """Work out the next poll interval, from the change in brightness"""
+
+        current = self._colors_brightness
+
+        if self._predicting:
+            return SCHEDULE_VERIFY_INTERVAL
+
+        if previous is None or current is None:
+            return self._t
+
+        for color, val in current.items():
+            if abs(val - previous.get(color, val)) > BRIGHTNESS_CHANGE_THRESHOLD:
+                return self._t
+
+        # Under a schedule the light can start a ramp at any time, without
+        # a schedule it only changes when it's told to.
+        max_interval = MAX_SCAN_INTERVAL
+
+        if not self._schedule_state:
+            max_interval = MAX_MANUAL_SCAN_INTERVAL
+
+        return min(self._poll_interval * 2, max_interval)
+
+    async def _async_update(self):
+
+        import aiohttp
+        from aquaipy.error import Error
+
+        # Don't touch the network while the device is known to be down
+        if self._breaker.is_open:
+            self.stats.throttled += 1
+            return
+
+        probe_timeout = None
+
+        if self._breaker.is_half_open:
+            probe_timeout = PROBE_TIMEOUT.total_seconds()
+
+        start = time.monotonic()
+
+        try:
+            colors_brightness, schedule_state = await asyncio.wait_for(
+                self._async_fetch(), probe_timeout)
+        except (Error, aiohttp.ClientError, asyncio.TimeoutError) as err:
+            self.stats.record_failure(time.monotonic() - start, err)
+            self._handle_failure(err)
+            return
+        except Exception as err:
+            _LOGGER.exception("Unexpected error fetching from %s (%s)",
+                              self.name, self._host)
+            self.stats.record_failure(time.monotonic() - start, err)
+            self._handle_failure(err)
+            return
+
+        processing_start = time.monotonic()
+        self.stats.record_success(processing_start - start)
+
+        if self._breaker.failures:
+            _LOGGER.info("Reconnected to %s (%s)", self.name, self._host)
+
+        self._breaker.record_success()
+
+        previous = self._colors_brightness
+        previous_schedule_state = self._schedule_state
+
+        self._colors_brightness = colors_brightness
+        self._schedule_state = schedule_state
+
+        try:
+            self._update_schedule_model()
+            self._save_snapshot(previous, previous_schedule_state)
+            self._poll_interval = self._next_poll_interval(previous)
+        except Exception as err:
+            _LOGGER.exception("Unexpected error processing a reading from %s",
+                              self.name)
+            self._handle_failure(err)
+            return
+
+        self._last_update = dt.utcnow()
+        self.stats.blocked += time.monotonic() - processing_start
+
+    async def _async_fetch(self):
+        """Connect if needed, then fetch the brightness and schedule state"""
+
+        from aquaipy.error import ConnError
+
+        if self._host is None:
+            raise ConnError("Not found on subnet", self._subnet)
+
+        if not self.connected:
+            await self._device.async_connect(self._host)
+            await self._async_update_metadata()
             self._connected = True
-            
-        self._colors_brightness = await self._device.async_get_colors_brightness()
-        self._schedule_state = await self._device.async_get_schedule_state()
 
-        self.attr[ATTR_LAST_UPDATE] = dt.utcnow()
+        colors_brightness = await self._device.async_get_colors_brightness()
+        schedule_state = await self._device.async_get_schedule_state()
+
+        if colors_brightness is None or schedule_state is None:
+            raise ConnError("Invalid response from device", self._host)
+
+        return colors_brightness, schedule_state
+
+    def _handle_failure(self, err):
+        """Back off from a device that failed, logging only the first error"""
+
+        from aquaipy.error import FirmwareError, MustBeParentError
+
+        if isinstance(err, FirmwareError):
+            message = "Invalid firmware version for target device"
+        elif isinstance(err, MustBeParentError):
+            message = "The specifed device must be the parent light, if paired. Please verify"
+        elif not self.connected:
+            message = "Unable to connect to specified device, please verify the host name"
+        else:
+            message = "Lost connection to device"
+
+        self._connected = False
+        backoff = self._breaker.record_failure()
+        self._poll_interval = timedelta(seconds=backoff)
+
+        log = _LOGGER.debug
+
+        if self._breaker.failures == 1:
+            log = _LOGGER.error
+
+        log("%s: %s (%s), retrying in %.0fs",
+            message, self.name, self._host, backoff)
+
+        # It may have a new address, so look for this one light again
+        if self._should_resolve():
+            self._resolving = self._hass.async_create_task(
+                self._async_resolve())
+
+    def _should_resolve(self):
+        """Check if it's time to look for the device on its subnet"""
+
+        if self._subnet is None or self._resolving is not None:
+            return False
+
+        if self._host is not None and \
+                self._breaker.failures < RESOLVE_AFTER_FAILURES:
+            return False
+
+        return self._last_resolve is None or \
+            time.monotonic() - self._last_resolve > \
+            RESOLVE_MIN_INTERVAL.total_seconds()
+
+    async def _async_resolve(self):
+        """Find the device on its subnet, by MAC address"""
+
+        self.async_record_scan()
+
+        try:
+            found = await async_scan(self._subnet, [self._mac])
+        finally:
+            self._resolving = None
+
+        host = found.get(self._mac)
+
+        if host is None or host == self._host:
+            return
+
+        self.async_set_host(host)
+
+    @callback
+    def async_record_scan(self):
+        """Note that the device has just been looked for on its subnet"""
+
+        self._last_resolve = time.monotonic()
+
+    @callback
+    def async_set_host(self, host):
+        """Move the device to a new host, and retry it straight away"""
+
+        _LOGGER.info("Found %s at %s, was %s", self.name, host, self._host)
+
+        self._host = host
+        self._connected = False
+
+        if self._mac_addr is not None:
+            self._store.async_update(self._mac_addr, host=host)
+
+        self._breaker.record_success()
+        self._poll_interval = self._t
+        self._async_schedule_refresh()
+
+    async def _async_update_metadata(self):
+        """Fetch the channel list and model info, once per connect"""
+
+        colors = await self._device.async_get_colors()
+
+        if colors is None:
+            from aquaipy.error import ConnError
+            raise ConnError("Unable to retrieve color channels", self._host)
+
+        was_ready = self.ready
+
+        if self._mac_addr != self._device.mac_addr:
+            cached = self._store.get(self._device.mac_addr) or {}
+            self._schedule_model = AIScheduleModel(cached.get('schedule'))
+
+        self._mac_addr = self._device.mac_addr
+        self._colors = colors
+        self._product_type = self._device.product_type
+        self._firmware_version = self._device.firmware_version
+
+        self._store.async_update(
+            self._mac_addr,
+            host=self._host,
+            colors=self._colors,
+            product_type=self._product_type,
+            firmware_version=self._firmware_version)
+
+        # Entities for a device that has never connected are added now
+        if not was_ready:
+            async_dispatcher_send(self._hass, self.ready_signal)
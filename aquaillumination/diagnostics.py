@@ -0,0 +1,25 @@
+"""Refresh statistics for AquaIllumination devices"""
+from .stats import DurationStats
+
+# Histogram bucket bounds, in milliseconds, for a light on the local network
+DURATION_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+class RefreshStats(DurationStats):
+    """Refreshes of one light, with those skipped while another was in
+    flight, and the time spent on the event loop handing out the result.
+    """
+
+    def __init__(self):
+
+        super().__init__(DURATION_BUCKETS)
+        self.throttled = 0
+        self.blocked = 0.0
+
+    def as_dict(self):
+
+        data = super().as_dict()
+        data['throttled'] = self.throttled
+        data['blocked_ms'] = round(self.blocked * 1000, 1)
+
+        return data
@@ -4,13 +4,13 @@ import voluptuous as vol
 
 # Import the device class from the component that you want to support
 from homeassistant.components.light import ( ATTR_BRIGHTNESS,
-    SUPPORT_BRIGHTNESS, Light, LIGHT_TURN_ON_SCHEMA,
-    VALID_BRIGHTNESS)
-from homeassistant.exceptions import PlatformNotReady
+    ATTR_TRANSITION, SUPPORT_BRIGHTNESS, SUPPORT_TRANSITION, Light,
+    LIGHT_TURN_ON_SCHEMA, VALID_BRIGHTNESS)
+from homeassistant.core import callback
 import homeassistant.helpers.config_validation as cv
-from homeassistant.util import dt
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 
-from . import DATA_INDEX, ATTR_LAST_UPDATE, SCAN_INTERVAL
+from . import DATA_INDEX, SCAN_INTERVAL, async_when_ready
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -21,19 +21,17 @@ async def async_setup_platform(hass, config, add_devices, discovery_info=None):
     if DATA_INDEX not in hass.data:
         return False
 
-    all_devices = []
+    @callback
+    def async_add_device(device):
+        """Add a light for each channel of the device"""
 
-    for host, device in hass.data[DATA_INDEX].items():
-
-        if not device.connected:
-            raise PlatformNotReady
-
-        colors = await device.raw_device.async_get_colors()
+        add_devices([AquaIllumination(device, color)
+                     for color in device.colors], True)
 
-        for color in colors:
-            all_devices.append(AquaIllumination(device, color))
-
-    add_devices(all_devices)
+    # Channels come from the metadata cached by the device, lights that have
+    # never connected are added once they do.
+    for host, device in hass.data[DATA_INDEX].items():
+        async_when_ready(hass, device, async_add_device)
 
 
 class AquaIllumination(Light):
@@ -45,8 +43,10 @@ class AquaIllumination(Light):
         self._name = self._light.name + ' ' + channel.replace("_", " ")
         self._state = None
         self._brightness = None
+        self._available = False
         self._channel = channel
         self._unique_id = "{0}_{1}_light".format(self._light.mac_addr, self._channel)
+        self._unsub_dispatcher = None
     
     @property
     def name(self):
@@ -56,9 +56,9 @@ class AquaIllumination(Light):
     
     @property
     def should_poll(self):
-        """Polling required"""
+        """No polling needed, updates are pushed by the device coordinator"""
 
-        return True
+        return False
 
     @property
     def is_on(self):
@@ -76,7 +76,7 @@ class AquaIllumination(Light):
     def supported_features(self):
         """Flag supported features"""
         
-        return SUPPORT_BRIGHTNESS
+        return SUPPORT_BRIGHTNESS | SUPPORT_TRANSITION
 
     @property
     def brightness(self):
@@ -84,21 +84,11 @@ class AquaIllumination(Light):
 
         return self._brightness
 
-    @property
-    def device_state_attributes(self):
-
-        return self._light.attr
-
     @property
     def available(self):
         """Return if the device is available"""
 
-        if ATTR_LAST_UPDATE not in self.device_state_attributes:
-            return False
-
-        last_update = self.device_state_attributes[ATTR_LAST_UPDATE]
-
-        return (dt.utcnow() - last_update) < (3 * self._light.throttle)
+        return self._available
 
     @property
     def unique_id(self):
@@ -109,40 +99,56 @@ class AquaIllumination(Light):
         """Turn color channel to given percentage"""
 
         brightness = (kwargs.get(ATTR_BRIGHTNESS, 255) / 255) * 100
-        colors_pct = await self._light.raw_device.async_get_colors_brightness()
 
-        for color,val in colors_pct.items():
-            
-            # For the moment we don't support HD mode, for these lights. This
-            # means that we limit all channels to a max of 100%, when setting
-            # the brightness. The next part works around that, until this 
-            # support is added.
-            
-            if val > 100:
-                colors_pct[color] = 100
+        _LOGGER.debug("Turn on %s: %s", self._channel, brightness)
+        await self._light.async_set_colors_brightness(
+            {self._channel: brightness}, kwargs.get(ATTR_TRANSITION))
+
+    async def async_turn_off(self, **kwargs):
+        """Turn color channel to 0%"""
 
-        colors_pct[self._channel] = brightness
+        await self._light.async_set_colors_brightness(
+            {self._channel: 0}, kwargs.get(ATTR_TRANSITION))
+    
+    async def async_added_to_hass(self):
+        """Subscribe to updates from the device coordinator"""
 
-        _LOGGER.debug("Turn on result: " + str(colors_pct))
-        await self._light.raw_device.async_set_colors_brightness(colors_pct)
+        self._unsub_dispatcher = async_dispatcher_connect(
+            self.hass, self._light.update_signal, self._handle_update)
 
-    async def turn_off(self):
-        """Turn all color channels to 0%"""
+    async def async_will_remove_from_hass(self):
+        """Unsubscribe from the device coordinator"""
 
-        colors_pct = await self._light.raw_device.async_get_colors_brightness()
-        colors_pct[self._channel] = 0
+        if self._unsub_dispatcher is not None:
+            self._unsub_dispatcher()
+            self._unsub_dispatcher = None
+
+    @callback
+    def _handle_update(self):
+        """Handle a new snapshot, only writing state when it has changed"""
+
+        if self._update_from_device():
+            self.async_schedule_update_ha_state()
 
-        await self._light.raw_device.async_set_colors_brightness(colors_pct)
-    
     async def async_update(self):
-        """Fetch new state data for this light"""
-        
-        await self._light.async_update()
-        
-        brightness = self._light.colors_brightness[self._channel]
-        self._state = "off"
+        """Read the latest cached state for this light"""
+
+        self._update_from_device()
+
+    def _update_from_device(self):
+        """Read the cached state for this light, returns True if it changed"""
+
+        previous = (self._state, self._brightness, self._available)
+        self._available = self._light.available
+
+        if self._light.colors_brightness is not None:
+
+            brightness = self._light.colors_brightness[self._channel]
+            self._state = "off"
+
+            if brightness > 0:
+                self._state = 'on'
 
-        if brightness > 0:
-            self._state = 'on'
+            self._brightness = (brightness / 100) * 255
 
-        self._brightness = (brightness / 100) * 255
+        return previous != (self._state, self._brightness, self._available)
@@ -0,0 +1,100 @@
+"""Find AquaIllumination lights on a subnet, by MAC address"""
+import asyncio
+import ipaddress
+import logging
+import time
+
+import voluptuous as vol
+
+_LOGGER = logging.getLogger(__name__)
+
+# A /24 is swept in a few rounds of probes, with most addresses refusing the
+# connection or timing out quickly.
+SCAN_CONCURRENCY = 64
+SCAN_PROBE_TIMEOUT = 1.5
+
+# Larger subnets would take minutes, and thousands of probes, to sweep
+MAX_SCAN_ADDRESSES = 1024
+
+
+def normalize_mac(mac):
+    """Get a MAC address in the form reported by the lights, e.g. D8976003AA01"""
+
+    return mac.replace(':', '').replace('-', '').replace('.', '').upper()
+
+
+def validate_subnet(value):
+    """Voluptuous validator for a subnet, e.g. 192.168.1.0/24"""
+
+    network = ipaddress.ip_network(value, strict=False)
+
+    if network.num_addresses > MAX_SCAN_ADDRESSES:
+        raise vol.Invalid("Subnet {} is too large to scan, at most {} "
+                          "addresses (a /22) are allowed".format(
+                              network, MAX_SCAN_ADDRESSES))
+
+    return str(network)
+
+
+async def async_scan(subnet, macs, concurrency=SCAN_CONCURRENCY,
+                     timeout=SCAN_PROBE_TIMEOUT):
+    """Probe a subnet for the lights with the given MAC addresses.
+
+    Every address is asked for its identity, with at most *concurrency*
+    probes in flight. The scan stops as soon as all of the lights are found.
+
+    :returns: dictionary of (normalized) MAC address and host
+    """
+
+    import aiohttp
+
+    wanted = {normalize_mac(mac) for mac in macs}
+    found = {}
+    hosts = iter(ipaddress.ip_network(subnet, strict=False).hosts())
+    start = time.monotonic()
+
+    # A separate session, as the shared one only allows a single connection
+    # per light and a few in total.
+    connector = aiohttp.TCPConnector(limit=concurrency, force_close=True)
+
+    async with aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+
+        async def async_worker():
+            """Probe addresses until there are none left, or all are found"""
+
+            for host in hosts:
+                if found.keys() >= wanted:
+                    return
+
+                mac = await _async_probe(session, str(host))
+
+                if mac in wanted:
+                    found[mac] = str(host)
+
+        await asyncio.gather(*[async_worker() for _ in range(concurrency)])
+
+    _LOGGER.debug("Scanned %s in %.2fs, found %s", subnet,
+                  time.monotonic() - start, found)
+
+    return found
+
+
+async def _async_probe(session, host):
+    """Get the MAC address of the light at a host, or None"""
+
+    import aiohttp
+
+    try:
+        async with session.get(
+                "http://{0}/api/identity".format(host)) as resp:
+            data = await resp.json(content_type=None)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return None
+
+    if not isinstance(data, dict) or data.get('response_code') != 0 or \
+            not data.get('serial_number'):
+        return None
+
+    return normalize_mac(data['serial_number'])
@@ -0,0 +1,122 @@
+"""Local model of an AquaIllumination light schedule"""
+import bisect
+
+MINUTES_PER_DAY = 24 * 60
+
+# Points further apart than this aren't trusted to interpolate between, as a
+# ramp could have started or finished in the gap.
+MAX_GAP_MINUTES = 30
+
+
+class AIScheduleModel:
+    """Per-channel brightness, by minute of the day, for a scheduled light.
+
+    AquaIPy has no call to download the schedule itself, so the model is
+    learned from the readings taken while the schedule is enabled. Schedules
+    repeat daily, so after a day of readings the brightness of every channel
+    can be predicted locally, by interpolating between the recorded points.
+    """
+
+    def __init__(self, points=None):
+
+        self._points = {}
+        self._minutes = []
+
+        for minute, colors in (points or {}).items():
+            self._points[int(minute)] = dict(colors)
+
+        self._minutes = sorted(self._points)
+
+    @staticmethod
+    def minute_of_day(when):
+        """Get the minute of the day for a (local) datetime"""
+
+        return when.hour * 60 + when.minute
+
+    def record(self, when, colors):
+        """Record the channel levels seen at the given (local) time.
+
+        :returns: *True* if this is a new minute for the model
+        """
+
+        minute = self.minute_of_day(when)
+        added = minute not in self._points
+
+        if added:
+            bisect.insort(self._minutes, minute)
+
+        self._points[minute] = dict(colors)
+
+        return added
+
+    def forget(self, when):
+        """Forget the recorded points either side of the given (local) time,
+        e.g. after that part of the schedule has changed
+        """
+
+        for minute in self._neighbours(when) or ():
+            if minute in self._points:
+                del self._points[minute]
+                self._minutes.remove(minute)
+
+    def clear(self):
+        """Forget all recorded points, e.g. after the schedule has changed"""
+
+        self._points = {}
+        self._minutes = []
+
+    def predict(self, when):
+        """Predict the channel levels at the given (local) time.
+
+        :returns: dictionary of color and brightness percentages, or *None*
+            if there aren't recorded points close enough either side.
+        """
+
+        neighbours = self._neighbours(when)
+
+        if neighbours is None:
+            return None
+
+        before, after = neighbours
+        minute = self.minute_of_day(when) + when.second / 60
+
+        gap_before = (minute - before) % MINUTES_PER_DAY
+        gap_after = (after - minute) % MINUTES_PER_DAY
+
+        if gap_before > MAX_GAP_MINUTES or gap_after > MAX_GAP_MINUTES:
+            return None
+
+        start = self._points[before]
+        end = self._points[after]
+
+        if start.keys() != end.keys():
+            return None
+
+        span = gap_before + gap_after
+
+        if span == 0:
+            return dict(start)
+
+        ratio = gap_before / span
+
+        return {color: start[color] + (end[color] - start[color]) * ratio
+                for color in start}
+
+    def _neighbours(self, when):
+        """Get the nearest recorded minutes either side of a (local) time,
+        wrapping around midnight, or None if nothing is recorded
+        """
+
+        if not self._minutes:
+            return None
+
+        minute = self.minute_of_day(when) + when.second / 60
+        index = bisect.bisect_right(self._minutes, minute)
+
+        return (self._minutes[index - 1],
+                self._minutes[index % len(self._minutes)])
+
+    def as_dict(self):
+        """Get the recorded points, in a form that can be stored"""
+
+        return {str(minute): colors for minute, colors in self._points.items()}
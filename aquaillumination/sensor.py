@@ -1,10 +1,11 @@
 import logging
 
-from homeassistant.const import DEVICE_CLASS_ILLUMINANCE
-from homeassistant.exceptions import PlatformNotReady
+from homeassistant.const import DEVICE_CLASS_ILLUMINANCE, DEVICE_CLASS_TIMESTAMP
+from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.entity import Entity
-from homeassistant.util import dt
-from . import DATA_INDEX, ATTR_LAST_UPDATE, SCAN_INTERVAL
+from . import DATA_INDEX, SCAN_INTERVAL, async_when_ready
+from .stats import DurationSensor
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -16,19 +17,24 @@ async def async_setup_platform(hass, config, add_entities, discovery_info=None):
     if DATA_INDEX not in hass.data:
         return False
 
-    all_entities = []
+    @callback
+    def async_add_device(device):
+        """Add the channel and diagnostic sensors of the device"""
 
-    for host, device in hass.data[DATA_INDEX].items():
-
-        if not device.connected:
-            raise PlatformNotReady
+        entities = [AquaIlluminationChannelBrightness(device, color)
+                    for color in device.colors]
+        entities.append(AILastUpdateSensor(device))
+        entities.append(DurationSensor(
+            '{0} refresh time'.format(device.name),
+            '{0}_refresh_time'.format(device.mac_addr),
+            device.stats, device.update_signal))
 
-        colors = await device.raw_device.async_get_colors()
+        add_entities(entities, True)
 
-        for color in colors:
-            all_entities.append(AquaIlluminationChannelBrightness(device, color))
-
-    add_entities(all_entities)
+    # Channels come from the metadata cached by the device, sensors for
+    # devices that have never connected are added once they do.
+    for host, device in hass.data[DATA_INDEX].items():
+        async_when_ready(hass, device, async_add_device)
 
 
 class AquaIlluminationChannelBrightness(Entity):
@@ -41,8 +47,10 @@ class AquaIlluminationChannelBrightness(Entity):
                 self._device.name,
                 channel.replace('_', ' '))
         self._state = None
+        self._available = False
         self._channel = channel
         self._unique_id = "{0}_{1}_sensor".format(self._device.mac_addr, channel) 
+        self._unsub_dispatcher = None
     
     @property
     def name(self):
@@ -52,9 +60,9 @@ class AquaIlluminationChannelBrightness(Entity):
     
     @property
     def should_poll(self):
-        """Polling required"""
+        """No polling needed, updates are pushed by the device coordinator"""
 
-        return True
+        return False
 
     @property
     def state(self):
@@ -81,25 +89,126 @@ class AquaIlluminationChannelBrightness(Entity):
         return self._unique_id
     
     @property
-    def device_state_attributes(self):
+    def available(self):
+        """Return if the device is available"""
+
+        return self._available
+    
+    async def async_added_to_hass(self):
+        """Subscribe to updates from the device coordinator"""
+
+        self._unsub_dispatcher = async_dispatcher_connect(
+            self.hass, self._device.update_signal, self._handle_update)
+
+    async def async_will_remove_from_hass(self):
+        """Unsubscribe from the device coordinator"""
+
+        if self._unsub_dispatcher is not None:
+            self._unsub_dispatcher()
+            self._unsub_dispatcher = None
+
+    @callback
+    def _handle_update(self):
+        """Handle a new snapshot, only writing state when it has changed"""
+
+        if self._update_from_device():
+            self.async_schedule_update_ha_state()
+
+    async def async_update(self):
+        """Read the latest cached state for this channel"""
 
-        return self._device.attr
+        self._update_from_device()
+
+    def _update_from_device(self):
+        """Read the cached state for this channel, returns True if changed"""
+
+        previous = (self._state, self._available)
+        self._available = self._device.available
+
+        if self._device.colors_brightness is not None:
+            brightness = self._device.colors_brightness[self._channel]
+            self._state = float("{0:.2f}".format(brightness))
+
+        return previous != (self._state, self._available)
+
+
+class AILastUpdateSensor(Entity):
+    """Diagnostic sensor, with the time of the last fetch from a device.
+
+    Freshness is tracked here rather than in the attributes of every
+    channel entity, so a refresh that changes nothing writes one state.
+    """
+
+    def __init__(self, device):
+        """Initialise the last update sensor"""
+        self._device = device
+        self._name = '{0} last update'.format(self._device.name)
+        self._state = None
+        self._unique_id = "{0}_last_update".format(self._device.mac_addr)
+        self._unsub_dispatcher = None
 
     @property
-    def available(self):
-        """Return if the device is available"""
+    def name(self):
+        """Get device name"""
 
-        if ATTR_LAST_UPDATE not in self.device_state_attributes:
-            return False
+        return self._name
 
-        last_update = self.device_state_attributes[ATTR_LAST_UPDATE]
+    @property
+    def should_poll(self):
+        """No polling needed, updates are pushed by the device coordinator"""
+
+        return False
+
+    @property
+    def state(self):
+        """Get device state"""
+
+        return self._state
+
+    @property
+    def device_class(self):
+        return DEVICE_CLASS_TIMESTAMP
+
+    @property
+    def icon(self):
+        return "mdi:update"
+
+    @property
+    def unique_id(self):
+
+        return self._unique_id
+
+    async def async_added_to_hass(self):
+        """Subscribe to updates from the device coordinator"""
+
+        self._unsub_dispatcher = async_dispatcher_connect(
+            self.hass, self._device.update_signal, self._handle_update)
+
+    async def async_will_remove_from_hass(self):
+        """Unsubscribe from the device coordinator"""
+
+        if self._unsub_dispatcher is not None:
+            self._unsub_dispatcher()
+            self._unsub_dispatcher = None
+
+    @callback
+    def _handle_update(self):
+        """Handle a new snapshot, only writing state when it has changed"""
+
+        if self._update_from_device():
+            self.async_schedule_update_ha_state()
 
-        return (dt.utcnow() - last_update) < (2 * self._device.throttle)
-    
     async def async_update(self):
-        """Fetch new state data for this channel"""
+        """Read the time of the last fetch from the device"""
+
+        self._update_from_device()
+
+    def _update_from_device(self):
+        """Read the last update time, returns True if it changed"""
+
+        previous = self._state
+
+        if self._device.last_update is not None:
+            self._state = self._device.last_update.isoformat()
 
-        await self._device.async_update()
-        
-        brightness = self._device.colors_brightness[self._channel]
-        self._state = float("{0:.2f}".format(brightness))
+        return previous != self._state
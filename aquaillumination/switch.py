@@ -4,10 +4,10 @@ import voluptuous as vol
 # Import the device class from the component that you want to support
 from homeassistant.components.switch import SwitchDevice, PLATFORM_SCHEMA
 from homeassistant.const import CONF_HOST, CONF_NAME
-from homeassistant.exceptions import PlatformNotReady
+from homeassistant.core import callback
 import homeassistant.helpers.config_validation as cv
-from homeassistant.util import dt
-from . import DATA_INDEX, ATTR_LAST_UPDATE, SCAN_INTERVAL
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from . import DATA_INDEX, SCAN_INTERVAL, async_when_ready
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -18,16 +18,16 @@ async def async_setup_platform(hass, config, add_devices, discovery_info=None):
     if DATA_INDEX not in hass.data:
         return False
 
-    all_devices = []
+    @callback
+    def async_add_device(device):
+        """Add the scheduled mode switch of the device"""
 
-    for host, device in hass.data[DATA_INDEX].items():
-
-        if not device.connected:
-            raise PlatformNotReady
-
-        all_devices.append(AIAutomatedScheduleSwitch(device))
+        add_devices([AIAutomatedScheduleSwitch(device)], True)
 
-    add_devices(all_devices)
+    # The switch is keyed by MAC address, so for devices that have never
+    # connected it is added once they do.
+    for host, device in hass.data[DATA_INDEX].items():
+        async_when_ready(hass, device, async_add_device)
 
 
 class AIAutomatedScheduleSwitch(SwitchDevice):
@@ -38,6 +38,8 @@ class AIAutomatedScheduleSwitch(SwitchDevice):
         self._device = device
         self._name = self._device.name + ' scheduled mode'
         self._state = None
+        self._available = False
+        self._unsub_dispatcher = None
     
     @property
     def name(self):
@@ -47,9 +49,9 @@ class AIAutomatedScheduleSwitch(SwitchDevice):
     
     @property
     def should_poll(self):
-        """Polling required"""
+        """No polling needed, updates are pushed by the device coordinator"""
 
-        return True
+        return False
 
     @property
     def is_on(self):
@@ -66,39 +68,57 @@ class AIAutomatedScheduleSwitch(SwitchDevice):
         
         return "off"
     
-    @property
-    def device_state_attributes(self):
-
-        return self._device.attr
-
     @property
     def available(self):
         """Return if the device is available"""
 
-        if ATTR_LAST_UPDATE not in self.device_state_attributes:
-            return False
-
-        last_update = self.device_state_attributes[ATTR_LAST_UPDATE]
-
-        return (dt.utcnow() - last_update) < (3 * self._device.throttle)
+        return self._available
 
     @property
     def unique_id(self):
 
         return self._device.mac_addr
 
-    async def turn_on(self, **kwargs):
+    async def async_turn_on(self, **kwargs):
         """Enable schedule mode"""
-        
-        await self._device.raw_device.async_set_schedule_state(True)
 
-    async def turn_off(self):
+        await self._device.async_set_schedule_state(True)
+
+    async def async_turn_off(self, **kwargs):
         """Disable schedule mode"""
-        
-        await self._device.raw_device.async_set_schedule_state(False)
+
+        await self._device.async_set_schedule_state(False)
+
+    async def async_added_to_hass(self):
+        """Subscribe to updates from the device coordinator"""
+
+        self._unsub_dispatcher = async_dispatcher_connect(
+            self.hass, self._device.update_signal, self._handle_update)
+
+    async def async_will_remove_from_hass(self):
+        """Unsubscribe from the device coordinator"""
+
+        if self._unsub_dispatcher is not None:
+            self._unsub_dispatcher()
+            self._unsub_dispatcher = None
+
+    @callback
+    def _handle_update(self):
+        """Handle a new snapshot, only writing state when it has changed"""
+
+        if self._update_from_device():
+            self.async_schedule_update_ha_state()
 
     async def async_update(self):
-        """Fetch new state data for scheduled mode"""
+        """Read the latest cached state for scheduled mode"""
+
+        self._update_from_device()
 
-        await self._device.async_update()
+    def _update_from_device(self):
+        """Read the cached schedule state, returns True if it changed"""
+
+        previous = (self._state, self._available)
+        self._available = self._device.available
         self._state = self._device.schedule_state
+
+        return previous != (self._state, self._available)
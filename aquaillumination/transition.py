@@ -0,0 +1,127 @@
+"""Client side brightness transitions for an AquaIllumination light"""
+from datetime import timedelta
+import logging
+import time
+
+from homeassistant.helpers.event import async_track_time_interval
+
+_LOGGER = logging.getLogger(__name__)
+
+# The lights have no transition support of their own, so ramps are sent as
+# a series of writes. At most one write per tick, whatever is ramping.
+TRANSITION_TICK = timedelta(seconds=1)
+
+
+class AIChannelRamp:
+    """Linear ramp of one channel, from its level when the ramp started"""
+
+    def __init__(self, start_value, target, duration):
+
+        self.target = target
+        self._start_value = start_value
+        self._start = time.monotonic()
+        self._duration = duration
+
+    @property
+    def finished(self):
+
+        return time.monotonic() - self._start >= self._duration
+
+    def value(self):
+        """Get the level of the channel, for the current point of the ramp"""
+
+        if self._duration <= 0:
+            return self.target
+
+        ratio = min(1.0, (time.monotonic() - self._start) / self._duration)
+
+        return self._start_value + (self.target - self._start_value) * ratio
+
+
+class AITransitionEngine:
+    """Ramps the channels of one light, at a bounded rate.
+
+    Every channel that is ramping, from any number of overlapping
+    transitions, is merged into a single write per tick. A new transition
+    for a channel takes over from wherever its current ramp has got to.
+    """
+
+    def __init__(self, hass, write, tick=TRANSITION_TICK):
+        """Initialise the engine.
+
+        :param write: coroutine function, taking a dictionary of channels
+            and brightness percentages, that writes them to the light
+        """
+
+        self._hass = hass
+        self._write = write
+        self._tick = tick
+        self._ramps = {}
+        self._writing = False
+        self._unsub_tick = None
+
+    @property
+    def active(self):
+        """Check if any channels are ramping"""
+
+        return bool(self._ramps)
+
+    def start(self, colors, duration, current):
+        """Start ramping the given channels to their targets.
+
+        :param colors: dictionary of color and target brightness percentage
+        :param duration: length of the transition, in seconds
+        :param current: the current brightness of each channel
+        """
+
+        for color, target in colors.items():
+
+            if color in self._ramps:
+                start_value = self._ramps[color].value()
+            else:
+                start_value = current.get(color, target)
+
+            self._ramps[color] = AIChannelRamp(start_value, target, duration)
+
+        if self._unsub_tick is None:
+            self._unsub_tick = async_track_time_interval(
+                self._hass, self._async_handle_tick, self._tick)
+
+    def cancel(self, colors=None):
+        """Stop ramping the given channels, or all of them, where they are"""
+
+        if colors is None:
+            self._ramps = {}
+        else:
+            for color in colors:
+                self._ramps.pop(color, None)
+
+        if not self._ramps and self._unsub_tick is not None:
+            self._unsub_tick()
+            self._unsub_tick = None
+
+    async def _async_handle_tick(self, now):
+        """Write the current point of every ramp, in one call"""
+
+        from aquaipy import Response
+
+        # Skip a tick rather than queue up writes behind a slow light
+        if self._writing or not self._ramps:
+            return
+
+        colors = {color: ramp.value() for color, ramp in self._ramps.items()}
+
+        self.cancel([color for color, ramp in self._ramps.items()
+                     if ramp.finished])
+
+        self._writing = True
+
+        try:
+            result = await self._write(colors)
+        finally:
+            self._writing = False
+
+        if result != Response.Success:
+            _LOGGER.warning("Stopping transition, the light didn't accept "
+                            "a change: %s", result)
+            self.cancel()
@@ -0,0 +1 @@
+"""Offline benchmarks for the custom components, run against local fakes."""
@@ -0,0 +1,385 @@
+"""Local stand-ins for the AquaIllumination, Seneye and uHoo devices"""
+from array import array
+import asyncio
+from datetime import datetime, timedelta, timezone
+import errno
+import math
+import socket
+import struct
+import threading
+import time
+from types import SimpleNamespace
+
+from aiohttp import web
+
+# Channels of a Hydra TwentySix
+AI_COLORS = ['deep_red', 'uv', 'violet', 'royal', 'blue', 'cool_white',
+             'green']
+
+# Inside the range of firmware AquaIPy supports
+AI_FIRMWARE = '2.2.0'
+
+# Length of a full dim and brighten cycle, while the schedule is enabled
+AI_RAMP_PERIOD = 600
+
+# Seneye USB packets are always this size
+SUD_PACKET_SIZE = 64
+
+# The default USB read timeout, in ms, after which an empty read raises
+# ETIMEDOUT
+SUD_READ_TIMEOUT = 1000
+
+
+async def _async_start_app(app):
+    """Serve an app on a free local port, returns the runner and port"""
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.SockSite(runner, sock).start()
+
+    return runner, sock.getsockname()[1]
+
+
+class FakeAILight:
+    """HTTP server emulating the local API of one AquaIllumination light.
+
+    Only the endpoints used by AquaIPy are served. While the schedule is
+    enabled, the channels ramp up and down, so the light looks busy.
+    """
+
+    def __init__(self, mac, counters, latency=0.0, ramp_period=AI_RAMP_PERIOD):
+
+        self.mac = mac
+        self.host = None
+        self._counters = counters
+        self._latency = latency
+        self._ramp_period = ramp_period
+        self._runner = None
+        self._schedule = True
+        self._intensity = {color: 500 for color in AI_COLORS}
+        self._offset = int(mac[-2:], 16)
+
+    async def async_start(self):
+        """Start serving, sets the host to configure the light with"""
+
+        app = web.Application(middlewares=[self._count])
+        app.router.add_get('/api/identity', self._identity)
+        app.router.add_get('/api/power', self._power)
+        app.router.add_get('/api/colors', self._get_colors)
+        app.router.add_post('/api/colors', self._set_colors)
+        app.router.add_get('/api/schedule/enable', self._get_schedule)
+        app.router.add_put('/api/schedule/enable', self._set_schedule)
+
+        self._runner, port = await _async_start_app(app)
+        self.host = '127.0.0.1:{}'.format(port)
+
+    async def async_stop(self):
+        """Stop serving"""
+
+        await self._runner.cleanup()
+
+    @web.middleware
+    async def _count(self, request, handler):
+
+        self._counters.increment('aquaillumination')
+
+        if self._latency:
+            await asyncio.sleep(self._latency)
+
+        return await handler(request)
+
+    async def _identity(self, request):
+
+        return web.json_response({
+            'response_code': 0,
+            'serial_number': self.mac,
+            'firmware': AI_FIRMWARE,
+            'product': 'Hydra TwentySix',
+            'parent': ''
+        })
+
+    async def _power(self, request):
+
+        return web.json_response({
+            'response_code': 0,
+            'devices': [{
+                'serial_number': self.mac,
+                'normal': {color: 10000 for color in AI_COLORS},
+                'hd': {color: 15000 for color in AI_COLORS},
+                'max_power': 95000
+            }]
+        })
+
+    def _scheduled_intensity(self):
+
+        phase = (time.time() + self._offset) / self._ramp_period * 2 * math.pi
+        value = round(500 + 400 * math.sin(phase))
+
+        return {color: value for color in AI_COLORS}
+
+    async def _get_colors(self, request):
+
+        if self._schedule:
+            intensity = self._scheduled_intensity()
+        else:
+            intensity = self._intensity
+
+        return web.json_response(dict(intensity, response_code=0))
+
+    async def _set_colors(self, request):
+
+        body = await request.json()
+
+        self._intensity = {color: int(body.get(color, 0))
+                           for color in AI_COLORS}
+
+        return web.json_response({'response_code': 0})
+
+    async def _get_schedule(self, request):
+
+        return web.json_response({'response_code': 0,
+                                  'enable': self._schedule})
+
+    async def _set_schedule(self, request):
+
+        body = await request.json()
+        self._schedule = bool(body['enable'])
+
+        return web.json_response({'response_code': 0})
+
+
+class FakeUhooAPI:
+    """HTTP server emulating the uHoo cloud API, for several accounts.
+
+    Each device has new data every *interval* seconds, like the 15 minute
+    cadence of the real API.
+    """
+
+    def __init__(self, counters, interval, latency=0.0):
+
+        self.url = None
+        self._counters = counters
+        self._interval = interval
+        self._latency = latency
+        self._runner = None
+        self._start = time.time()
+        self._accounts = {}
+
+    def add_account(self, email, devices):
+        """Add an account, with the given number of devices"""
+
+        self._accounts[email] = [
+            {'deviceName': 'bench_uhoo_{}_{}'.format(
+                len(self._accounts), index),
+             'serialNumber': '{}-{}'.format(email.split('@')[0], index),
+             'macAddress': '00:00:00:00:{:02x}:{:02x}'.format(
+                 len(self._accounts), index)}
+            for index in range(devices)]
+
+    async def async_start(self):
+        """Start serving, sets the API URL to give the client"""
+
+        app = web.Application(middlewares=[self._count])
+        app.router.add_post('/v1/getdevicelist', self._device_list)
+        app.router.add_post('/v1/getlatestdata', self._latest_data)
+        app.router.add_post('/v1/gethourlydata', self._hourly_data)
+
+        self._runner, port = await _async_start_app(app)
+        self.url = 'http://127.0.0.1:{}/v1/'.format(port)
+
+    async def async_stop(self):
+        """Stop serving"""
+
+        await self._runner.cleanup()
+
+    @web.middleware
+    async def _count(self, request, handler):
+
+        self._counters.increment('uhooair')
+
+        if self._latency:
+            await asyncio.sleep(self._latency)
+
+        return await handler(request)
+
+    async def _device_list(self, request):
+
+        data = await request.post()
+
+        if data.get('username') not in self._accounts:
+            raise web.HTTPUnauthorized()
+
+        return web.json_response(self._accounts[data['username']])
+
+    def _reading(self, when):
+
+        minute = when.timestamp() / 60
+
+        return {
+            'Temperature': round(21 + math.sin(minute / 30), 1),
+            'Relative Humidity': round(45 + 5 * math.sin(minute / 45), 1),
+            'PM2.5': round(5 + 2 * math.sin(minute / 20), 1),
+            'TVOC': round(150 + 30 * math.sin(minute / 25), 1),
+            'CO2': round(600 + 100 * math.sin(minute / 40), 1),
+            'CO': 0.0,
+            'Air Pressure': 1013.2,
+            'Ozone': round(10 + math.sin(minute / 35), 1),
+            'NO2': 0.0,
+            'Timestamp': int(when.timestamp()),
+            'DateTime': when.isoformat()
+        }
+
+    async def _latest_data(self, request):
+
+        periods = math.floor((time.time() - self._start) / self._interval)
+        when = datetime.fromtimestamp(
+            self._start + periods * self._interval, timezone.utc)
+
+        return web.json_response(self._reading(when))
+
+    async def _hourly_data(self, request):
+
+        hour = datetime.now(timezone.utc).replace(
+            minute=0, second=0, microsecond=0)
+
+        return web.json_response([
+            self._reading(hour - timedelta(hours=hours))
+            for hours in range(24, 0, -1)])
+
+
+class FakeUSBDevice:
+    """USB transport of one Seneye SUD, as used by pyseneye.
+
+    Commands written to the device queue their responses, and a sensor
+    reading is pushed every *interval* seconds while in interactive mode.
+    All calls are blocking, like the real transport, and run on the
+    Seneye worker pool.
+    """
+
+    def __init__(self, serial, counters, interval, latency=0.0):
+
+        self.serial_number = serial
+        self.bus = 1
+        self.address = 1
+        self.last_packet_at = None
+        self._counters = counters
+        self._interval = interval
+        self._latency = latency
+        self._queue = []
+        self._interactive = False
+        self._next_push = None
+        self._lock = threading.Lock()
+        self._written = threading.Condition(self._lock)
+
+    def write(self, endpoint, msg):
+        """Handle a command from pyseneye"""
+        from pyseneye.sud import (
+            GENERIC_RESPONSE, HELLOSUD_RESPONSE, DeviceType)
+
+        self._transfer()
+
+        with self._lock:
+            if msg == 'HELLOSUD':
+                self._interactive = True
+                self._next_push = time.monotonic() + self._interval
+                self._queue.append(struct.pack(
+                    HELLOSUD_RESPONSE, b'\x88\x01', True,
+                    DeviceType.REEF.value, 20100, bytes(58)))
+            elif msg == 'READING':
+                self._queue.append(struct.pack(
+                    GENERIC_RESPONSE, b'\x88\x02', True, bytes(61)))
+                self._queue.append(self._sensor_reading())
+                self.last_packet_at = time.monotonic()
+            elif msg == 'BYESUD':
+                self._interactive = False
+                self._queue.append(struct.pack(
+                    GENERIC_RESPONSE, b'\x77\x01', True, bytes(61)))
+
+            self._written.notify_all()
+
+        return len(msg)
+
+    def read(self, endpoint, packet_size, timeout=None):
+        """Return the next response, or wait for a pushed reading.
+
+        A command written while waiting ends the wait with its response.
+        """
+        from usb.core import USBError
+
+        self._transfer()
+
+        if timeout is None:
+            timeout = SUD_READ_TIMEOUT
+
+        deadline = time.monotonic() + timeout / 1000
+
+        with self._lock:
+            while not self._queue:
+                now = time.monotonic()
+
+                if self._interactive and self._next_push <= now:
+                    self._next_push = now + self._interval
+                    self.last_packet_at = now
+
+                    return array('B', self._sensor_reading())
+
+                if now >= deadline:
+                    raise USBError('Operation timed out',
+                                   errno=errno.ETIMEDOUT)
+
+                wake = deadline
+
+                if self._interactive:
+                    wake = min(wake, self._next_push)
+
+                self._written.wait(wake - now)
+
+            return array('B', self._queue.pop(0))
+
+    def close(self):
+        """Release the device"""
+
+        with self._lock:
+            self._interactive = False
+            self._queue = []
+
+    def _transfer(self):
+
+        self._counters.increment('seneye')
+
+        if self._latency:
+            time.sleep(self._latency)
+
+    @staticmethod
+    def _sensor_reading():
+        from pyseneye.sud import SUDREADING
+
+        minute = time.time() / 60
+
+        return struct.pack(
+            SUDREADING, b'\x00\x01', int(time.time()), bytes(2), 0,
+            round(810 + 5 * math.sin(minute / 30)),
+            round(7 + math.sin(minute / 20)),
+            round(25000 + 200 * math.sin(minute / 45)),
+            bytes(13), bytes(11), 0, 0, 0, 0, 0, 0, b'\x00')
+
+
+def create_fake_sud(dev):
+    """Open a fake SUD, replaces ``_open_device`` in the Seneye platform"""
+    from pyseneye.sud import SUDevice
+
+    class FakeSUDevice(SUDevice):
+        """SUDevice on the fake transport, without the pyusb housekeeping"""
+
+        def close(self):
+            self._instance.close()
+
+    device = FakeSUDevice.__new__(FakeSUDevice)
+    device._instance = dev
+    device._ep_in = SimpleNamespace(wMaxPacketSize=SUD_PACKET_SIZE)
+    device._ep_out = SimpleNamespace()
+
+    return device
@@ -0,0 +1,160 @@
+"""Measurements taken while the benchmark runs"""
+import asyncio
+from collections import defaultdict
+import functools
+import math
+import time
+
+# How often the loop monitor wakes up, any delay beyond this is time the
+# event loop was blocked.
+LOOP_MONITOR_INTERVAL = 0.05
+
+
+def percentile(values, pct):
+    """Get the given percentile of a list of values, by nearest rank"""
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+
+    return values[rank - 1]
+
+
+class Latencies:
+    """Durations, grouped by integration"""
+
+    def __init__(self):
+
+        self._samples = defaultdict(list)
+
+    def record(self, name, seconds):
+        """Record one duration"""
+
+        self._samples[name].append(seconds)
+
+    def reset(self):
+        """Forget all durations, e.g. once setup has finished"""
+
+        self._samples.clear()
+
+    def summary(self, name):
+        """Get the count and percentiles of a group, in milliseconds"""
+
+        samples = self._samples.get(name, [])
+
+        return {
+            'count': len(samples),
+            'p50': _ms(percentile(samples, 50)),
+            'p90': _ms(percentile(samples, 90)),
+            'p99': _ms(percentile(samples, 99)),
+            'max': _ms(max(samples, default=None))
+        }
+
+    def wrap_async(self, cls, method, name):
+        """Time every call to a coroutine method of a class"""
+
+        original = getattr(cls, method)
+
+        @functools.wraps(original)
+        async def timed(*args, **kwargs):
+            start = time.monotonic()
+
+            try:
+                return await original(*args, **kwargs)
+            finally:
+                self.record(name, time.monotonic() - start)
+
+        setattr(cls, method, timed)
+
+
+class Counters:
+    """Event counts, grouped by integration"""
+
+    def __init__(self):
+
+        self._counts = defaultdict(int)
+
+    def increment(self, name, count=1):
+        """Count an event"""
+
+        self._counts[name] += count
+
+    def get(self, name):
+        """Get the count for a group"""
+
+        return self._counts.get(name, 0)
+
+    def reset(self):
+        """Forget all counts, e.g. once setup has finished"""
+
+        self._counts.clear()
+
+
+class LoopMonitor:
+    """Measure how long the event loop was blocked.
+
+    A task sleeps for a short interval, over and over. Whenever it wakes up
+    late, something held the loop for that long.
+    """
+
+    def __init__(self, interval=LOOP_MONITOR_INTERVAL):
+
+        self._interval = interval
+        self._task = None
+        self._lags = []
+        self.blocked = 0.0
+
+    def start(self):
+        """Start monitoring the running loop"""
+
+        self._task = asyncio.ensure_future(self._async_monitor())
+
+    async def stop(self):
+        """Stop monitoring"""
+
+        if self._task is not None:
+            self._task.cancel()
+
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+            self._task = None
+
+    async def _async_monitor(self):
+
+        loop = asyncio.get_event_loop()
+
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self._interval)
+            lag = max(0.0, loop.time() - start - self._interval)
+
+            self._lags.append(lag)
+            self.blocked += lag
+
+    def reset(self):
+        """Forget all lags, e.g. once setup has finished"""
+
+        self._lags = []
+        self.blocked = 0.0
+
+    def summary(self):
+        """Get the total and worst blocking, in milliseconds"""
+
+        return {
+            'blocked': _ms(self.blocked),
+            'p99': _ms(percentile(self._lags, 99)),
+            'max': _ms(max(self._lags, default=None))
+        }
+
+
+def _ms(seconds):
+
+    if seconds is None:
+        return None
+
+    return round(seconds * 1000, 2)
@@ -0,0 +1,297 @@
+"""
+Benchmark the custom components against local fakes of their devices.
+
+Runs a real Home Assistant core, with the AquaIllumination, Seneye and uHoo
+integrations set up from a temporary config directory. The lights are
+served by local HTTP servers, the Seneye SUDs by a fake USB transport and
+the uHoo accounts by a local copy of the cloud API, so nothing leaves the
+machine.
+
+Usage, from the root of the repository:
+
+    python -m benchmarks.run --lights 8 --seneyes 2 --accounts 2 \\
+        --duration 120 --output bench_output.txt
+"""
+import argparse
+import asyncio
+from datetime import timedelta
+import functools
+import importlib
+import inspect
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from .fakes import FakeAILight, FakeUhooAPI, FakeUSBDevice, create_fake_sud
+from .metrics import Counters, Latencies, LoopMonitor
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INTEGRATIONS = ['aquaillumination', 'seneye', 'uhooair']
+
+# Prefixes of the entity ids created for each integration's fakes
+ENTITY_PREFIXES = {
+    'aquaillumination': 'bench_light',
+    'seneye': 'seneye',
+    'uhooair': 'bench_uhoo'
+}
+
+
+def _parse_args(argv):
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--lights', type=int, default=4,
+                        help='number of AquaIllumination lights')
+    parser.add_argument('--seneyes', type=int, default=2,
+                        help='number of Seneye SUDs')
+    parser.add_argument('--accounts', type=int, default=1,
+                        help='number of uHoo accounts')
+    parser.add_argument('--uhoo-devices', type=int, default=3,
+                        help='number of devices on each uHoo account')
+    parser.add_argument('--duration', type=float, default=60,
+                        help='seconds to measure for, after setup')
+    parser.add_argument('--ai-latency', type=float, default=0.0,
+                        help='seconds added to each light request')
+    parser.add_argument('--usb-latency', type=float, default=0.0,
+                        help='seconds added to each USB transfer')
+    parser.add_argument('--uhoo-latency', type=float, default=0.0,
+                        help='seconds added to each uHoo request')
+    parser.add_argument('--seneye-interval', type=float, default=5,
+                        help='seconds between readings pushed by a SUD')
+    parser.add_argument('--uhoo-interval', type=float, default=30,
+                        help='seconds between new uHoo data, in place of '
+                             'the 15 minutes of the real API')
+    parser.add_argument('--output',
+                        help='file to write the report to, as well')
+
+    return parser.parse_args(argv)
+
+
+def _create_config_dir():
+    """Config directory with the integrations linked in as custom components"""
+
+    config_dir = tempfile.mkdtemp(prefix='ha-bench-')
+    custom_components = os.path.join(config_dir, 'custom_components')
+    os.makedirs(custom_components)
+
+    for name in INTEGRATIONS:
+        os.symlink(os.path.join(REPO, name),
+                   os.path.join(custom_components, name))
+
+    return config_dir
+
+
+async def _async_create_hass(config_dir):
+    """Create a Home Assistant core, for the given config directory"""
+    from homeassistant import loader
+    from homeassistant.core import HomeAssistant
+
+    if 'config_dir' in inspect.signature(HomeAssistant).parameters:
+        hass = HomeAssistant(config_dir)
+    else:
+        hass = HomeAssistant()
+
+    hass.config.config_dir = config_dir
+    hass.config.skip_pip = True
+
+    if config_dir not in sys.path:
+        sys.path.insert(0, config_dir)
+
+    if hasattr(loader, 'async_setup'):
+        loader.async_setup(hass)
+
+    return hass
+
+
+def _instrument(latencies, counters, args, uhoo_url):
+    """Time the refresh paths, and point the integrations at the fakes"""
+
+    ai = importlib.import_module('custom_components.aquaillumination')
+    seneye = importlib.import_module('custom_components.seneye.sensor')
+    uhoo = importlib.import_module('custom_components.uhooair.sensor')
+
+    # The fetch itself, so refreshes skipped while a light is backing off
+    # aren't counted as instant ones.
+    latencies.wrap_async(ai.AIData, '_async_fetch', 'aquaillumination')
+    latencies.wrap_async(uhoo.UhooAccount, 'async_refresh', 'uhooair')
+
+    # Seneye readings are pushed, so time each one from when the fake made
+    # it available until it was passed on to the sensors.
+    process_reading = seneye.SeneyeData._process_reading
+
+    @functools.wraps(process_reading)
+    def timed_process_reading(self, resp):
+        dev = self._device._instance if self._device is not None else None
+
+        if dev is not None and dev.last_packet_at is not None:
+            latencies.record('seneye', time.monotonic() - dev.last_packet_at)
+
+        return process_reading(self, resp)
+
+    seneye.SeneyeData._process_reading = timed_process_reading
+
+    sud_devices = {
+        'BENCH{:04d}'.format(index): FakeUSBDevice(
+            'BENCH{:04d}'.format(index), counters, args.seneye_interval,
+            args.usb_latency)
+        for index in range(args.seneyes)}
+
+    seneye._find_devices = lambda: dict(sud_devices)
+    seneye._open_device = create_fake_sud
+
+    uhoo.UhooClient = functools.partial(uhoo.UhooClient, api_url=uhoo_url)
+    uhoo.DATA_INTERVAL = timedelta(seconds=args.uhoo_interval)
+    uhoo.DATA_GRACE = timedelta(seconds=1)
+    uhoo.RETRY_MIN_INTERVAL = timedelta(seconds=1)
+    uhoo.RETRY_MAX_INTERVAL = timedelta(seconds=args.uhoo_interval)
+
+
+async def async_run(args):
+    """Set everything up, measure for the duration, then report"""
+    from homeassistant.const import EVENT_STATE_CHANGED
+    from homeassistant.setup import async_setup_component
+
+    latencies = Latencies()
+    requests = Counters()
+    state_writes = Counters()
+    monitor = LoopMonitor()
+
+    lights = [FakeAILight('D8976003{:04X}'.format(index), requests,
+                          args.ai_latency)
+              for index in range(args.lights)]
+    uhoo_api = FakeUhooAPI(requests, args.uhoo_interval, args.uhoo_latency)
+
+    for index in range(args.accounts):
+        uhoo_api.add_account('bench{}@example.com'.format(index),
+                             args.uhoo_devices)
+
+    await asyncio.gather(*[light.async_start() for light in lights])
+    await uhoo_api.async_start()
+
+    config_dir = _create_config_dir()
+    hass = await _async_create_hass(config_dir)
+
+    try:
+        _instrument(latencies, requests, args, uhoo_api.url)
+
+        def count_state_write(event):
+            entity_id = event.data['entity_id']
+
+            for name, prefix in ENTITY_PREFIXES.items():
+                if prefix in entity_id:
+                    state_writes.increment(name)
+
+        hass.bus.async_listen(EVENT_STATE_CHANGED, count_state_write)
+
+        setup_start = time.monotonic()
+        monitor.start()
+
+        # The sensor platforms have to be set up before AquaIllumination
+        # loads the sensor component through discovery.
+        sensor_config = [{'platform': 'seneye'}] if args.seneyes else []
+        sensor_config += [
+            {'platform': 'uhooair', 'email': 'bench{}@example.com'.format(
+                index), 'password': 'bench'}
+            for index in range(args.accounts)]
+
+        await async_setup_component(hass, 'sensor', {'sensor': sensor_config})
+        await async_setup_component(hass, 'aquaillumination', {
+            'aquaillumination': [
+                {'host': light.host, 'name': 'bench_light_{}'.format(index)}
+                for index, light in enumerate(lights)]})
+
+        await hass.async_start()
+        await hass.async_block_till_done()
+
+        setup_time = time.monotonic() - setup_start
+        setup_blocked = monitor.blocked
+
+        # Only count what happens once everything is running
+        latencies.reset()
+        requests.reset()
+        state_writes.reset()
+        monitor.reset()
+
+        await asyncio.sleep(args.duration)
+        await monitor.stop()
+
+        report = _format_report(args, setup_time, setup_blocked, latencies,
+                                requests, state_writes, monitor)
+    finally:
+        await hass.async_stop()
+        await uhoo_api.async_stop()
+        await asyncio.gather(*[light.async_stop() for light in lights])
+        shutil.rmtree(config_dir, ignore_errors=True)
+
+    return report
+
+
+def _format_report(args, setup_time, setup_blocked, latencies, requests,
+                   state_writes, monitor):
+
+    minutes = args.duration / 60
+    counts = {'aquaillumination': args.lights, 'seneye': args.seneyes,
+              'uhooair': args.accounts * args.uhoo_devices}
+    transfers = {'aquaillumination': 'HTTP', 'seneye': 'USB',
+                 'uhooair': 'HTTP'}
+
+    lines = [
+        'Benchmark: {} lights, {} SUDs, {} uHoo accounts of {} devices, '
+        '{:.0f}s'.format(args.lights, args.seneyes, args.accounts,
+                         args.uhoo_devices, args.duration),
+        'Setup: {:.0f} ms, loop blocked {:.1f} ms'.format(
+            setup_time * 1000, setup_blocked * 1000),
+        '',
+        '{:<18}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}{:>12}{:>14}'.format(
+            'integration', 'devices', 'calls', 'p50 ms', 'p90 ms', 'p99 ms',
+            'max ms', 'I/O /min', 'writes /min')
+    ]
+
+    for name in INTEGRATIONS:
+        summary = latencies.summary(name)
+
+        lines.append(
+            '{:<18}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}{:>12}{:>14}'.format(
+                name, counts[name], summary['count'],
+                _fmt(summary['p50']), _fmt(summary['p90']),
+                _fmt(summary['p99']), _fmt(summary['max']),
+                '{:.1f} {}'.format(requests.get(name) / minutes,
+                                   transfers[name]),
+                '{:.1f}'.format(state_writes.get(name) / minutes)))
+
+    loop = monitor.summary()
+
+    lines += [
+        '',
+        'Event loop blocked: {} ms in total ({:.2f}%), p99 {} ms, '
+        'worst {} ms'.format(
+            _fmt(loop['blocked']),
+            loop['blocked'] / (args.duration * 10), _fmt(loop['p99']),
+            _fmt(loop['max']))
+    ]
+
+    return '\n'.join(lines)
+
+
+def _fmt(value):
+
+    return '-' if value is None else '{:.1f}'.format(value)
+
+
+def main(argv=None):
+    """Run the benchmark, print the report"""
+
+    args = _parse_args(argv)
+    report = asyncio.get_event_loop().run_until_complete(async_run(args))
+
+    print(report)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Read statistics for Seneye devices."""
+from .stats import DurationStats
+
+# Histogram bucket bounds, in milliseconds, for a call to the SUD over USB
+DURATION_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+# Every USB packet to and from a SUD is this size
+PACKET_SIZE = 64
+
+
+class ReadStats(DurationStats):
+    """USB calls to one device.
+
+    Calls run on the worker pool, so the time on the event loop is only
+    that taken to process each reading. Calls that had to wait for another
+    one to the same device are counted as lock waits.
+    """
+
+    def __init__(self):
+
+        super().__init__(DURATION_BUCKETS)
+        self.lock_waits = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.blocked = 0.0
+
+    def record_transfer(self, sent=0, received=0):
+        """Count the bytes sent, and the packets received."""
+
+        self.bytes_sent += sent
+        self.bytes_received += received * PACKET_SIZE
+
+    def as_dict(self):
+
+        data = super().as_dict()
+        data['lock_waits'] = self.lock_waits
+        data['bytes_sent'] = self.bytes_sent
+        data['bytes_received'] = self.bytes_received
+        data['blocked_ms'] = round(self.blocked * 1000, 1)
+
+        return data
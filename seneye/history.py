@@ -0,0 +1,255 @@
+"""Compact history of Seneye readings, with rolling statistics."""
+from array import array
+from collections import deque
+import math
+import os
+import struct
+
+FIELDS = ('temperature', 'ph', 'nh3')
+
+# File layout: header (capacity, count), then the timestamps and one column
+# per field, each as an array of doubles in ring order.
+HEADER = '<II'
+
+
+class RollingWindow:
+    """Min, max, mean and slope of one field, over a rolling time window.
+
+    Entries are referenced by their sequence number in the ring buffer, so
+    the window holds no copies of the values. Each reading is added and
+    evicted once, and the min/max are kept with monotonic queues, so the
+    statistics are updated in amortised O(1) per reading.
+    """
+
+    def __init__(self, seconds, timestamps, values, capacity):
+
+        self._seconds = seconds
+        self._timestamps = timestamps
+        self._values = values
+        self._capacity = capacity
+        self._head = 0
+        self._origin = None
+        self._count = 0
+        self._sum_t = 0.0
+        self._sum_tt = 0.0
+        self._sum_x = 0.0
+        self._sum_tx = 0.0
+        self._min = deque()
+        self._max = deque()
+
+    def _get(self, seq):
+
+        index = seq % self._capacity
+
+        return self._timestamps[index], self._values[index]
+
+    def _hours(self, timestamp):
+
+        # Relative to the first reading, to keep the sums small
+        return (timestamp - self._origin) / 3600
+
+    def add(self, seq):
+        """Add the reading with the given sequence number to the window"""
+
+        timestamp, value = self._get(seq)
+
+        if not math.isnan(value):
+
+            if self._origin is None:
+                self._origin = timestamp
+
+            hours = self._hours(timestamp)
+
+            self._count += 1
+            self._sum_t += hours
+            self._sum_tt += hours * hours
+            self._sum_x += value
+            self._sum_tx += hours * value
+
+            while self._min and self._get(self._min[-1])[1] >= value:
+                self._min.pop()
+            self._min.append(seq)
+
+            while self._max and self._get(self._max[-1])[1] <= value:
+                self._max.pop()
+            self._max.append(seq)
+
+        cutoff = timestamp - self._seconds
+
+        while self._head < seq and self._get(self._head)[0] < cutoff:
+            self._evict()
+
+    def release(self, seq):
+        """Drop any readings that are about to be overwritten by seq"""
+
+        while self._head <= seq - self._capacity:
+            self._evict()
+
+    def _evict(self):
+        """Drop the oldest reading from the window"""
+
+        timestamp, value = self._get(self._head)
+
+        if not math.isnan(value):
+            hours = self._hours(timestamp)
+
+            self._count -= 1
+            self._sum_t -= hours
+            self._sum_tt -= hours * hours
+            self._sum_x -= value
+            self._sum_tx -= hours * value
+
+            if self._min and self._min[0] == self._head:
+                self._min.popleft()
+
+            if self._max and self._max[0] == self._head:
+                self._max.popleft()
+
+        self._head += 1
+
+    def stats(self):
+        """Get the min, max, mean and slope (per hour) of the window"""
+
+        if self._count == 0:
+            return None
+
+        mean = self._sum_x / self._count
+        slope = None
+
+        denominator = self._count * self._sum_tt - self._sum_t ** 2
+
+        if self._count > 1 and denominator > 1e-9:
+            slope = (self._count * self._sum_tx -
+                     self._sum_t * self._sum_x) / denominator
+
+        return {
+            'min': self._get(self._min[0])[1],
+            'max': self._get(self._max[0])[1],
+            'mean': mean,
+            'slope': slope
+        }
+
+
+class ReadingHistory:
+    """Fixed size, array backed ring buffer of readings."""
+
+    def __init__(self, capacity, windows):
+        """Initialise the history.
+
+        :param capacity: number of readings to keep
+        :param windows: dictionary of window name and length in seconds
+        """
+
+        self._capacity = capacity
+        self._window_lengths = windows
+        self._count = 0
+        self._timestamps = array('d', [0.0]) * capacity
+        self._columns = {field: array('d', [math.nan]) * capacity
+                         for field in FIELDS}
+        self._windows = self._create_windows()
+
+    def _create_windows(self):
+
+        return {
+            name: {field: RollingWindow(seconds, self._timestamps,
+                                        self._columns[field], self._capacity)
+                   for field in FIELDS}
+            for name, seconds in self._window_lengths.items()
+        }
+
+    def __len__(self):
+
+        return min(self._count, self._capacity)
+
+    def append(self, timestamp, values):
+        """Add a reading, and update the rolling statistics.
+
+        :param timestamp: Unix epoch time of the reading
+        :param values: dictionary of field and value, missing fields are
+            stored as NaN
+        """
+
+        seq = self._count
+        index = seq % self._capacity
+
+        for windows in self._windows.values():
+            for window in windows.values():
+                window.release(seq)
+
+        self._timestamps[index] = timestamp
+
+        for field in FIELDS:
+            value = values.get(field)
+            self._columns[field][index] = math.nan if value is None else value
+
+        self._count += 1
+
+        for windows in self._windows.values():
+            for window in windows.values():
+                window.add(seq)
+
+    def stats(self, field):
+        """Get the statistics of a field, for every window"""
+
+        return {name: windows[field].stats()
+                for name, windows in self._windows.items()}
+
+    def snapshot(self):
+        """Copy the history, so it can be saved while more are appended.
+
+        :returns: tuple of capacity, count, timestamps and columns, to pass
+            to :meth:`save`
+        """
+
+        return (self._capacity, self._count, array('d', self._timestamps),
+                {field: array('d', self._columns[field]) for field in FIELDS})
+
+    @staticmethod
+    def save(path, snapshot):
+        """Write a snapshot of the history to disk. Blocking."""
+
+        capacity, count, timestamps, columns = snapshot
+        temp_path = path + '.tmp'
+
+        with open(temp_path, 'wb') as file:
+            file.write(struct.pack(HEADER, capacity, count))
+            timestamps.tofile(file)
+
+            for field in FIELDS:
+                columns[field].tofile(file)
+
+        os.replace(temp_path, path)
+
+    def load(self, path):
+        """Read the history back from disk, if it was saved. Blocking."""
+
+        if not os.path.exists(path):
+            return
+
+        with open(path, 'rb') as file:
+            header = file.read(struct.calcsize(HEADER))
+
+            if len(header) != struct.calcsize(HEADER):
+                raise EOFError("Truncated history header")
+
+            capacity, count = struct.unpack(HEADER, header)
+
+            timestamps = array('d')
+            timestamps.fromfile(file, capacity)
+
+            columns = {}
+
+            for field in FIELDS:
+                columns[field] = array('d')
+                columns[field].fromfile(file, capacity)
+
+        # Replay the stored readings, oldest first, so the capacity can
+        # differ from the one they were saved with.
+        first = max(0, count - capacity)
+
+        for seq in range(first, count):
+            index = seq % capacity
+            self.append(timestamps[index], {
+                field: None if math.isnan(columns[field][index])
+                else columns[field][index]
+                for field in FIELDS})
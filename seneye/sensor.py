@@ -7,13 +7,29 @@ This custom component is based on the Awair component in HA.
 https://github.com/home-assistant/home-assistant/blob/dev/homeassistant/components/sensor/awair.py
 """
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+import errno
 import logging
+import os
+import struct
+import time
 
-from homeassistant.const import DEVICE_CLASS_TEMPERATURE, TEMP_CELSIUS
+from homeassistant.const import (
+    DEVICE_CLASS_TEMPERATURE, EVENT_HOMEASSISTANT_STOP, TEMP_CELSIUS)
+from homeassistant.core import callback
 from homeassistant.exceptions import PlatformNotReady
+from homeassistant.helpers.dispatcher import (
+    async_dispatcher_connect, async_dispatcher_send)
 from homeassistant.helpers.entity import Entity
-from homeassistant.util import Throttle, dt
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt, slugify
+
+from .diagnostics import ReadStats
+from .history import ReadingHistory
+from .stats import DiagnosticsView, DurationSensor
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -21,6 +37,9 @@ ATTR_TIMESTAMP = 'timestamp'
 ATTR_LAST_SLIDE_READ = 'last_slide_update'
 ATTR_SENEYE_DEVICE_TYPE = 'seneye_device_type'
 
+SIGNAL_UPDATE_SENEYE = 'seneye_update_{}'
+DATA_DIAGNOSTICS = 'seneye_diagnostics'
+
 
 DEVICE_CLASS_PH = 'PH'
 DEVICE_CLASS_FREE_AMMONIA = 'NH3'
@@ -41,54 +60,249 @@ SENSOR_TYPES = {
 }
 
 
-SCAN_INTERVAL = timedelta(minutes=5)
+# The device pushes readings by itself. If none have arrived for this long,
+# a reading is requested from it.
 SENEYE_SLIDE_READ_INTERVAL = timedelta(minutes=30)
+SENEYE_RECONNECT_DELAY = timedelta(seconds=30)
+
+# Waiting for a pushed reading is one long USB read, rather than a short one
+# every second. Stopping sends the device a command, to end the wait.
+SENEYE_PUSH_READ_TIMEOUT = timedelta(minutes=5)
+
+# Readings are pushed, so staleness is checked for on a timer of its own
+SENEYE_AVAILABILITY_INTERVAL = timedelta(minutes=1)
+
+# Readings kept on disk for each device, with rolling statistics over these
+# windows, exposed as attributes.
+SENEYE_HISTORY_SIZE = 4096
+SENEYE_HISTORY_WINDOWS = {'1h': 3600, '24h': 86400}
+SENEYE_HISTORY_SAVE_INTERVAL = timedelta(minutes=10)
+
+# USB I/O for all devices is shared out over this many worker threads
+SENEYE_MAX_WORKERS = 8
+
+# The serial of the device that owns the sensor ids from before several
+# devices were supported, chosen once and then kept.
+STORAGE_KEY = 'seneye'
+STORAGE_VERSION = 1
+
 
 async def async_setup_platform(hass, config, async_add_entities,
                                discovery_info=None):
     """Setup Seneye objects"""
 
+    executor = ThreadPoolExecutor(max_workers=SENEYE_MAX_WORKERS)
+    all_data = []
+
     try:
 
-        seneye_data = SeneyeData(SENEYE_SLIDE_READ_INTERVAL)
-        
-        await seneye_data.async_update()
-        
-        all_sensors = []
+        serials = await hass.loop.run_in_executor(executor, _find_devices)
 
-        for sensor in SENSOR_TYPES:
-            if sensor in seneye_data.data:
-                seneye_sensor = SeneyeSensor(seneye_data, sensor, SENEYE_SLIDE_READ_INTERVAL)
-                all_sensors.append(seneye_sensor)
+        if not serials:
+            raise ValueError("Device not found")
+
+        all_data = [SeneyeData(hass, serial, SENEYE_SLIDE_READ_INTERVAL,
+                               executor)
+                    for serial in sorted(serials)]
+        legacy_serial = await _async_get_legacy_serial(hass, serials)
+
+        await asyncio.gather(*[
+            seneye_data.async_load_history() for seneye_data in all_data])
+
+        # Take the first reading from every device in parallel
+        await asyncio.gather(*[
+            seneye_data.async_refresh() for seneye_data in all_data])
+
+        if not any(seneye_data.data for seneye_data in all_data):
+            raise ValueError("No reading from device")
+
+        @callback
+        def async_add_sensors(seneye_data):
+            """Add the sensors for the fields a device has sent."""
+            show_serial = len(all_data) > 1
+            legacy_id = seneye_data.serial == legacy_serial
+
+            sensors = [SeneyeSensor(seneye_data, sensor, show_serial,
+                                    legacy_id)
+                       for sensor in SENSOR_TYPES
+                       if sensor in seneye_data.data]
+            sensors.append(_create_read_time_sensor(seneye_data, show_serial))
+
+            async_add_entities(sensors)
+
+        for seneye_data in all_data:
+            if seneye_data.data:
+                async_add_sensors(seneye_data)
+            else:
+                _LOGGER.warning("No reading from Seneye device %s yet, its "
+                                "sensors will be added when it sends one",
+                                seneye_data.serial)
+                _async_when_reading(hass, seneye_data, async_add_sensors)
+
+        for seneye_data in all_data:
+            seneye_data.async_start()
+
+        if DATA_DIAGNOSTICS not in hass.data:
+            hass.data[DATA_DIAGNOSTICS] = {}
+            hass.http.register_view(
+                DiagnosticsView('seneye', hass.data[DATA_DIAGNOSTICS]))
 
-        async_add_entities(all_sensors, True)
+        for seneye_data in all_data:
+            hass.data[DATA_DIAGNOSTICS][seneye_data.serial] = seneye_data
+
+        async def async_close(event):
+            """Close all devices, then stop the workers."""
+            await asyncio.gather(*[
+                seneye_data.async_close() for seneye_data in all_data])
+            executor.shutdown(wait=False)
+
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_close)
 
         return
 
     except Exception as e:
         _LOGGER.error("Error: {0}".format(e))
 
+    await asyncio.gather(*[
+        seneye_data.async_close() for seneye_data in all_data])
+    executor.shutdown(wait=False)
+
     raise PlatformNotReady
 
 
+async def _async_get_legacy_serial(hass, serials):
+    """Get the serial of the device that keeps the old sensor ids.
+
+    Decided the first time this runs: a lone device is the one that was
+    there before, with several it can't be told, so none is. It doesn't
+    change as devices are plugged in or out later.
+    """
+    store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+    data = await store.async_load()
+
+    if data is None:
+        data = {'legacy_serial': next(iter(serials)) if len(serials) == 1
+                else None}
+        await store.async_save(data)
+
+    return data['legacy_serial']
+
+
+@callback
+def _async_when_reading(hass, data, action):
+    """Call action with a device, once it has sent its first reading."""
+    unsub = None
+
+    @callback
+    def async_handle_update():
+        """Run the action once, when there is a reading."""
+        if data.data:
+            unsub()
+            action(data)
+
+    unsub = async_dispatcher_connect(
+        hass, data.update_signal, async_handle_update)
+
+
+def _create_read_time_sensor(data, show_serial):
+    """Create the diagnostic sensor for the USB calls to a device."""
+    name = 'Seneye read time'
+
+    if show_serial:
+        name = 'Seneye {} read time'.format(data.serial)
+
+    return DurationSensor(name, 'seneye_{}_read_time'.format(data.serial),
+                          data.stats, data.update_signal)
+
+
+def _find_devices():
+    """Find all attached SUDs, keyed by serial number. Blocking."""
+    import usb.core
+    from pyseneye.sud import VENDOR_ID, PRODUCT_ID
+
+    devices = {}
+
+    for dev in usb.core.find(find_all=True, idVendor=VENDOR_ID,
+                             idProduct=PRODUCT_ID):
+        try:
+            serial = dev.serial_number
+        except (OSError, ValueError):
+            serial = None
+
+        # Reading the serial number can need extra permissions, so fall back
+        # to the position of the device on the bus.
+        if not serial:
+            serial = "{0}-{1}".format(dev.bus, dev.address)
+
+        devices[serial] = dev
+
+    return devices
+
+
+def _open_device(dev):
+    """Open a specific SUD. Blocking.
+
+    Mirrors ``SUDevice.__init__``, which always opens the first SUD found.
+    """
+    import usb.util
+    from pyseneye.sud import SUDevice
+
+    if dev.is_kernel_driver_active(0):
+        dev.detach_kernel_driver(0)
+
+    dev.set_configuration()
+    usb.util.claim_interface(dev, 0)
+    intf = dev.get_active_configuration()[(0, 0)]
+
+    device = SUDevice.__new__(SUDevice)
+    device._instance = dev
+    device._ep_in = usb.util.find_descriptor(
+        intf,
+        custom_match=lambda e:
+        usb.util.endpoint_direction(e.bEndpointAddress) ==
+        usb.util.ENDPOINT_IN)
+    device._ep_out = usb.util.find_descriptor(
+        intf,
+        custom_match=lambda e:
+        usb.util.endpoint_direction(e.bEndpointAddress) ==
+        usb.util.ENDPOINT_OUT)
+
+    if device._ep_in is None or device._ep_out is None:
+        raise ValueError("Device endpoints not found")
+
+    return device
+
+
 class SeneyeSensor(Entity):
     """Implementation of a Seneye sensor."""
 
-    def __init__(self, data, sensor_type, throttle):
+    def __init__(self, data, sensor_type, show_serial=False,
+                 legacy_id=False):
         """Initialize the sensor."""
         self._device_class = SENSOR_TYPES[sensor_type]['device_class']
         self._name = 'Seneye {}'.format(self._device_class)
+
+        # Tell devices apart by serial number, when there is more than one
+        if show_serial:
+            self._name = 'Seneye {} {}'.format(data.serial, self._device_class)
+
         unit = SENSOR_TYPES[sensor_type]['unit_of_measurement']
         self._unit_of_measurement = unit
         self._data = data
         self._type = sensor_type
-        self._throttle = throttle
+        self._legacy_id = legacy_id
+        self._unsub_dispatcher = None
 
     @property
     def name(self):
         """Return the name of the sensor."""
         return self._name
 
+    @property
+    def should_poll(self):
+        """No polling needed, readings are pushed by the device."""
+        return False
+
     @property
     def device_class(self):
         """Return the device class."""
@@ -115,69 +329,411 @@ class SeneyeSensor(Entity):
 
         seneye_device_type = self._data.attrs[ATTR_SENEYE_DEVICE_TYPE]
        
-        return {ATTR_LAST_SLIDE_READ: formatted_dt, 
-                ATTR_SENEYE_DEVICE_TYPE: seneye_device_type}
+        attrs = {ATTR_LAST_SLIDE_READ: formatted_dt, 
+                 ATTR_SENEYE_DEVICE_TYPE: seneye_device_type}
+
+        # Rolling statistics, e.g. min_1h, slope_24h (change per hour)
+        for window, stats in self._data.history.stats(self._type).items():
+            if stats is None:
+                continue
+
+            for stat, value in stats.items():
+                if value is not None:
+                    attrs['{}_{}'.format(stat, window)] = round(value, 4)
+
+        return attrs
 
     @property
     def available(self):
-        """Device availability based on the last update timestamp.
-        
-        Data should be updating every 30mins, so we'll say it's unavailable
-        if it takes over an hour to update.
-        """
-        if ATTR_LAST_SLIDE_READ not in self._data.attrs:
-            return False
-
-        last_api_data = self._data.attrs[ATTR_LAST_SLIDE_READ]
-        return (dt.utcnow() - last_api_data) < (2 * self._throttle)
+        """Return if the device is sending readings."""
+        return self._data.available
 
     @property
     def unique_id(self):
-        """Return the unique id of this entity."""
-        return "seneye_{}".format(self._type)
+        """Return the unique id of this entity.
+
+        The device that was there before several were supported keeps its
+        old id, so its entities and their history carry on.
+        """
+        if self._legacy_id:
+            return "seneye_{}".format(self._type)
+
+        return "seneye_{}_{}".format(self._data.serial, self._type)
 
     @property
     def unit_of_measurement(self):
         """Return the unit of measurement of this entity."""
         return self._unit_of_measurement
 
-    async def async_update(self):
-        """Get the latest data."""
-        await self._data.async_update()
+    async def async_added_to_hass(self):
+        """Subscribe to readings from the device."""
+        self._unsub_dispatcher = async_dispatcher_connect(
+            self.hass, self._data.update_signal, self._handle_update)
+
+    async def async_will_remove_from_hass(self):
+        """Unsubscribe from readings from the device."""
+        if self._unsub_dispatcher is not None:
+            self._unsub_dispatcher()
+            self._unsub_dispatcher = None
+
+    @callback
+    def _handle_update(self):
+        """Write the new reading to the state machine."""
+        self.async_schedule_update_ha_state()
 
 
 class SeneyeData:
-    """Get data from Seneye device."""
+    """Get data from Seneye device.
+
+    All USB I/O runs on a worker pool shared by all devices, so it never
+    blocks the event loop. The device is kept open in interactive mode, and a
+    background reader passes on the readings it sends as they arrive.
+    """
 
-    def __init__(self, throttle):
+    def __init__(self, hass, serial, throttle, executor):
         """Initialize the data object."""
         self.data = {}
         self.attrs = {}
-        self.async_update = Throttle(throttle)(self._async_update)
-
-    async def _async_update(self):
-        """Get the data from SUD."""
-        from pyseneye.sud import SUDevice, Action, DeviceType
-        
-        device = SUDevice()
-        device_type = None
-        resp = None
-        try:
-            data = device.action(Action.ENTER_INTERACTIVE_MODE)
-            device_type = data.device_type.name
+        self.serial = serial
+        self._hass = hass
+        self._throttle = throttle
+        self._device = None
+        self._device_type = None
+        self._last_reading = None
+        self._reader = None
+        self._failed = False
+        self._available = False
+        self._unsub_tick = None
+        self._stop = asyncio.Event()
+        self._executor = executor
+
+        self.stats = ReadStats()
+        self.history = ReadingHistory(
+            SENEYE_HISTORY_SIZE, SENEYE_HISTORY_WINDOWS)
+        self._history_path = hass.config.path(
+            '.storage', 'seneye_{}.readings'.format(slugify(serial)))
+        self._history_saved = time.monotonic()
+
+        # Only one call to the device at a time, even on a shared pool
+        self._lock = asyncio.Lock()
 
-            resp = device.action(Action.SENSOR_READING)
-            if not resp:
-                return
+    @property
+    def update_signal(self):
+        """Dispatcher signal sent for each new reading from this device."""
+        return SIGNAL_UPDATE_SENEYE.format(self.serial)
 
-        finally:
-            device.close()
+    def diagnostics(self):
+        """Get the read statistics for this device."""
+        return self.stats.as_dict()
+
+    @property
+    def available(self):
+        """Device availability based on the last reading and read.
+
+        Data should be updating every 30mins, so we'll say it's unavailable
+        if it takes over an hour to update, or straight away if the device
+        can't be read.
+        """
+        if self._failed or ATTR_LAST_SLIDE_READ not in self.attrs:
+            return False
+
+        last_api_data = self.attrs[ATTR_LAST_SLIDE_READ]
+        return (dt.utcnow() - last_api_data) < (2 * self._throttle)
+
+    async def _async_run(self, func):
+        """Run a blocking call for this device on the worker pool."""
+
+        if self._lock.locked():
+            self.stats.lock_waits += 1
 
+        async with self._lock:
+            start = time.monotonic()
+
+            try:
+                result = await self._hass.loop.run_in_executor(
+                    self._executor, func)
+            except Exception as err:
+                self.stats.record_failure(time.monotonic() - start, err)
+                raise
+
+            if result is not None:
+                self.stats.record_success(time.monotonic() - start)
+
+            return result
+
+    async def async_refresh(self):
+        """Request a reading from the SUD."""
+
+        try:
+            resp = await self._async_run(self._read)
+        except (OSError, TimeoutError, ValueError) as err:
+            _LOGGER.error("Unable to read from Seneye device: %s", err)
+            return
+
+        if resp:
+            self._process_reading(resp)
+
+    def async_start(self):
+        """Start the background reader, and the availability check."""
+
+        self._available = self.available
+
+        if self._reader is None:
+            self._reader = self._hass.async_create_task(self._async_reader())
+
+        if self._unsub_tick is None:
+            self._unsub_tick = async_track_time_interval(
+                self._hass, self._async_check_available,
+                SENEYE_AVAILABILITY_INTERVAL)
+
+    @callback
+    def _async_check_available(self, now=None):
+        """Tell the sensors when the device goes stale, or comes back."""
+
+        if self.available != self._available:
+            self._available = self.available
+            async_dispatcher_send(self._hass, self.update_signal)
+
+    async def _async_reader(self):
+        """Wait for readings pushed by the SUD, until stopped."""
+
+        while not self._stop.is_set():
+            try:
+                resp = await self._async_run(self._read_pushed)
+
+                if resp is not None:
+                    self._process_reading(resp)
+                elif self._failed:
+                    # Back again, with nothing pushed yet
+                    self._failed = False
+                    self._async_check_available()
+
+                continue
+            except asyncio.CancelledError:
+                raise
+            except (OSError, TimeoutError, ValueError) as err:
+                log = _LOGGER.debug if self._failed else _LOGGER.error
+                log("Unable to read from Seneye device: %s", err)
+            except Exception:
+                _LOGGER.exception("Unexpected error reading from Seneye "
+                                  "device %s", self.serial)
+
+            self._failed = True
+            self._async_check_available()
+
+            try:
+                await asyncio.wait_for(
+                    self._stop.wait(),
+                    SENEYE_RECONNECT_DELAY.total_seconds())
+            except asyncio.TimeoutError:
+                pass
+
+    @callback
+    def _process_reading(self, resp):
+        """Store a new reading and pass it on to the sensors."""
+
+        start = time.monotonic()
+
+        self._failed = False
+        self._available = True
         self.attrs[ATTR_LAST_SLIDE_READ] = dt.utcnow()
-        self.attrs[ATTR_SENEYE_DEVICE_TYPE] = device_type
+        self.attrs[ATTR_SENEYE_DEVICE_TYPE] = self._device_type
 
         for sensor in SENSOR_TYPES:
 
             self.data[sensor] = getattr(resp, sensor, None)
 
-        _LOGGER.debug("Got Seneye data")
+        self.history.append(time.time(), self.data)
+
+        if time.monotonic() - self._history_saved > \
+                SENEYE_HISTORY_SAVE_INTERVAL.total_seconds():
+            self._hass.async_create_task(self.async_save_history())
+
+        _LOGGER.debug("Got Seneye data from %s", self.serial)
+
+        async_dispatcher_send(self._hass, self.update_signal)
+
+        self.stats.blocked += time.monotonic() - start
+
+    async def async_close(self, event=None):
+        """Stop the reader, leave interactive mode and close the device."""
+
+        # Let the reader finish its current USB read, rather than cancel
+        # it, so the close can't overlap with it on another worker.
+        self._stop.set()
+
+        if self._unsub_tick is not None:
+            self._unsub_tick()
+            self._unsub_tick = None
+
+        if self._reader is not None:
+            await self._hass.loop.run_in_executor(
+                self._executor, self._interrupt_read)
+            await self._reader
+            self._reader = None
+
+        await self._async_run(self._close)
+        await self.async_save_history()
+
+    async def async_load_history(self):
+        """Load the stored readings for this device."""
+
+        try:
+            await self._hass.async_add_executor_job(
+                self.history.load, self._history_path)
+        except (OSError, EOFError, ValueError, struct.error) as err:
+            _LOGGER.warning("Unable to load Seneye history for %s, "
+                            "discarding it: %s", self.serial, err)
+            self.history = ReadingHistory(
+                SENEYE_HISTORY_SIZE, SENEYE_HISTORY_WINDOWS)
+
+            try:
+                await self._hass.async_add_executor_job(
+                    os.remove, self._history_path)
+            except OSError:
+                pass
+
+    async def async_save_history(self):
+        """Store the readings for this device."""
+
+        self._history_saved = time.monotonic()
+
+        if not len(self.history):
+            return
+
+        # Copied on the loop, as readings are appended while it's written
+        snapshot = self.history.snapshot()
+
+        try:
+            await self._hass.async_add_executor_job(
+                ReadingHistory.save, self._history_path, snapshot)
+        except OSError as err:
+            _LOGGER.warning("Unable to save Seneye history for %s: %s",
+                            self.serial, err)
+
+    def _open(self):
+        """Open the device and enter interactive mode, on the worker."""
+        from pyseneye.sud import Action
+
+        # Find the device again, as it may have been re-plugged
+        dev = _find_devices().get(self.serial)
+
+        if dev is None:
+            raise ValueError("Device {} not found".format(self.serial))
+
+        device = _open_device(dev)
+
+        try:
+            self._record_action(Action.ENTER_INTERACTIVE_MODE)
+            data = device.action(Action.ENTER_INTERACTIVE_MODE)
+        except Exception:
+            device.close()
+            raise
+
+        self._device = device
+        self._device_type = data.device_type.name
+
+    def _read(self):
+        """Take a sensor reading, re-opening the device if needed."""
+        from pyseneye.sud import Action
+
+        if self._device is None:
+            self._open()
+
+        try:
+            self._record_action(Action.SENSOR_READING)
+            resp = self._device.action(Action.SENSOR_READING)
+        except Exception:
+            self._close()
+            raise
+
+        self._last_reading = time.monotonic()
+
+        return resp
+
+    def _read_pushed(self):
+        """Wait for a reading sent by the device, on the worker.
+
+        Returns None if nothing arrived before the USB read timed out, or the
+        wait was ended by a stop, so the reader can check which.
+        """
+        from pyseneye.sud import ACTION_DEFINITIONS, Action
+        from usb.core import USBError
+
+        # Nothing has been pushed for a while, so ask for a reading
+        if self._last_reading is None or \
+                time.monotonic() - self._last_reading > \
+                self._throttle.total_seconds():
+            return self._read()
+
+        if self._device is None:
+            self._open()
+
+        try:
+            # As SUDevice._read, but with a long timeout
+            raw_data = self._device._instance.read(
+                self._device._ep_in, self._device._ep_in.wMaxPacketSize,
+                timeout=int(SENEYE_PUSH_READ_TIMEOUT.total_seconds() * 1000))
+        except USBError as err:
+            if err.errno == errno.ETIMEDOUT:
+                return None
+
+            self._close()
+            raise
+
+        self.stats.record_transfer(received=1)
+
+        rdef = ACTION_DEFINITIONS[Action.SENSOR_READING].read_definitions[-1]
+
+        # Light meter readings are pushed too, but aren't used yet
+        if raw_data[0:2] != rdef.validator:
+            return None
+
+        self._last_reading = time.monotonic()
+
+        return rdef.return_type(raw_data, rdef)
+
+    def _interrupt_read(self):
+        """End a pending read, by asking the device to leave interactive
+        mode. Blocking, runs outside the device lock.
+        """
+        from pyseneye.sud import ACTION_DEFINITIONS, Action
+
+        device = self._device
+
+        if device is None:
+            return
+
+        try:
+            self._record_action(Action.LEAVE_INTERACTIVE_MODE)
+            device._instance.write(
+                device._ep_out,
+                ACTION_DEFINITIONS[Action.LEAVE_INTERACTIVE_MODE].cmd_str)
+        except Exception as err:
+            _LOGGER.debug("Unable to interrupt the read: %s", err)
+
+    def _close(self):
+        """Leave interactive mode and close the device, on the worker."""
+        from pyseneye.sud import Action
+
+        if self._device is None:
+            return
+
+        device = self._device
+        self._device = None
+
+        try:
+            self._record_action(Action.LEAVE_INTERACTIVE_MODE)
+            device.action(Action.LEAVE_INTERACTIVE_MODE)
+        except Exception as err:
+            _LOGGER.debug("Unable to leave interactive mode: %s", err)
+        finally:
+            device.close()
+
+    def _record_action(self, action):
+        """Count the packets an action sends and expects back."""
+        from pyseneye.sud import ACTION_DEFINITIONS
+
+        cdef = ACTION_DEFINITIONS[action]
+        self.stats.record_transfer(len(cdef.cmd_str or ''),
+                                   len(cdef.read_definitions))
@@ -0,0 +1,157 @@
+"""Backfill of missed uHoo readings into the recorder's statistics"""
+import logging
+
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt, slugify
+
+from .client import UhooError
+
+_LOGGER = logging.getLogger(__name__)
+
+STATISTICS_SOURCE = 'uhooair'
+
+# Last hour imported for each device, so only the missed hours are imported.
+# One file per account, as each account is a separate platform.
+STORAGE_KEY = 'uhooair.{}.backfill'
+LEGACY_STORAGE_KEY = 'uhooair.backfill'
+STORAGE_VERSION = 1
+
+
+class UhooBackfill:
+    """Import the hourly readings stored in the cloud, as statistics.
+
+    The readings are fetched a whole page at a time, and each sensor's hours
+    are imported with a single call, so an outage doesn't have to be replayed
+    as thousands of state changes.
+    """
+
+    def __init__(self, hass, client, email, sensor_types):
+
+        self._hass = hass
+        self._client = client
+        self._sensor_types = sensor_types
+        self._store = Store(hass, STORAGE_VERSION,
+                            STORAGE_KEY.format(slugify(email)))
+        self._imported = {}
+        self._devices = {}
+        self._running = set()
+        self._add_statistics = None
+
+    async def async_load(self):
+        """Load the last hour imported for each device."""
+
+        try:
+            from homeassistant.components.recorder.statistics import (
+                async_add_external_statistics)
+        except ImportError:
+            _LOGGER.warning("This version of Home Assistant can't import "
+                            "statistics, missed uHoo readings won't be "
+                            "backfilled")
+            return
+
+        self._add_statistics = async_add_external_statistics
+        imported = await self._store.async_load()
+
+        # Progress was stored in one file shared by every account, before
+        if imported is None:
+            imported = await Store(
+                self._hass, STORAGE_VERSION, LEGACY_STORAGE_KEY).async_load()
+
+        self._imported = imported or {}
+
+    def add_devices(self, devices):
+        """Backfill the given (stored) devices."""
+
+        for device in devices:
+            self._devices[device["serialNumber"]] = device
+
+    def async_schedule(self, serial):
+        """Backfill a device in the background, unless it already is."""
+
+        if self._add_statistics is None or serial not in self._devices or \
+                serial in self._running:
+            return
+
+        # Checked here rather than at load, as the recorder may be set up
+        # after this platform.
+        if 'recorder' not in self._hass.config.components:
+            return
+
+        self._running.add(serial)
+        self._hass.async_create_task(self._async_backfill(serial))
+
+    async def _async_backfill(self, serial):
+
+        try:
+            records = await self._client.async_get_hourly_data(serial)
+        except UhooError as err:
+            _LOGGER.warning("Unable to backfill uHoo device %s: %s",
+                            serial, err)
+            return
+        finally:
+            self._running.discard(serial)
+
+        device = self._devices[serial]
+        last = self._imported.get(serial)
+        last = dt.parse_datetime(last) if last else None
+
+        # The current hour isn't complete yet, so is left to the recorder
+        current = dt.utcnow().replace(minute=0, second=0, microsecond=0)
+        hours = {}
+
+        for record in records:
+            start = _parse_hour(record.get('DateTime'))
+
+            if start is None or start >= current or \
+                    (last is not None and start <= last):
+                continue
+
+            hours[start] = record
+
+        if not hours:
+            return
+
+        starts = sorted(hours)
+
+        for sensor in device["sensors"]:
+            statistics = [
+                {'start': start, 'mean': hours[start][sensor],
+                 'min': hours[start][sensor], 'max': hours[start][sensor]}
+                for start in starts if hours[start].get(sensor) is not None]
+
+            if not statistics:
+                continue
+
+            self._add_statistics(self._hass, {
+                'has_mean': True,
+                'has_sum': False,
+                'name': '{0} {1}'.format(
+                    device["deviceName"],
+                    self._sensor_types[sensor]['device_class']),
+                'source': STATISTICS_SOURCE,
+                'statistic_id': '{0}:{1}'.format(
+                    STATISTICS_SOURCE, slugify(
+                        '{0}_{1}'.format(serial, sensor))),
+                'unit_of_measurement':
+                    self._sensor_types[sensor]['unit_of_measurement']
+            }, statistics)
+
+        _LOGGER.debug("Backfilled %d hours of uHoo device %s",
+                      len(starts), serial)
+
+        self._imported[serial] = starts[-1].isoformat()
+        await self._store.async_save(self._imported)
+
+
+def _parse_hour(value):
+    """Get the start of the hour, in UTC, for a reading's DateTime."""
+
+    if not value:
+        return None
+
+    when = dt.parse_datetime(value)
+
+    if when is None:
+        return None
+
+    return dt.as_utc(when).replace(minute=0, second=0, microsecond=0)
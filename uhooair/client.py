@@ -0,0 +1,113 @@
+"""
+Async client for the uHoo API.
+
+Talks to the same endpoints as pyuhooair, but on an aiohttp session, so no
+blocking requests are made from the event loop.
+"""
+
+import asyncio
+import json
+import logging
+from urllib.parse import urlencode
+
+import aiohttp
+
+_LOGGER = logging.getLogger(__name__)
+
+API_URL = 'https://api.uhooinc.com/v1/'
+REQUEST_TIMEOUT = 30
+
+# Names of the fields in the API response, for each sensor type. These match
+# the names used by pyuhooair.
+API_FIELDS = {
+    'CO': 'CO',
+    'air_pressure': 'Air Pressure',
+    'humidity': 'Relative Humidity',
+    'co2': 'CO2',
+    'voc': 'TVOC',
+    'dust': 'PM2.5',
+    'timestamp': 'Timestamp',
+    'ozone': 'Ozone',
+    'NO2': 'NO2',
+    'DateTime': 'DateTime'
+}
+
+
+class UhooError(Exception):
+    """Raised when a request to the uHoo API fails."""
+
+
+class UhooClient:
+    """Async client for the uHoo API."""
+
+    def __init__(self, session, email, password, api_url=API_URL):
+        """Initialize the client.
+
+        :param session: aiohttp session to make the requests on
+        :param api_url: base URL of the API, can be changed for testing
+        """
+        from pyuhooair.auth import UhooAuth
+
+        # UhooAuth only hashes the password, it doesn't make any requests
+        auth = UhooAuth(email, password)
+
+        self._session = session
+        self._api_url = api_url
+        self._credentials = {
+            'username': auth.email,
+            'password': auth.hexdigest
+        }
+
+    async def _async_post(self, endpoint, stats=None, **kwargs):
+        """Make a request to the API, returns the decoded response.
+
+        :param stats: optional FetchStats, to count the bytes transferred
+        """
+
+        data = dict(self._credentials, **kwargs)
+
+        try:
+            async with self._session.post(
+                    self._api_url + endpoint, data=data,
+                    timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)) \
+                    as resp:
+                resp.raise_for_status()
+                body = await resp.read()
+
+            if stats is not None:
+                stats.record_transfer(len(urlencode(data)), len(body))
+
+            return json.loads(body)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+            raise UhooError(
+                "Request to {} failed: {}".format(endpoint, err)) from err
+
+    async def async_get_devices(self):
+        """Get the list of devices on the account."""
+
+        return await self._async_post('getdevicelist')
+
+    async def async_get_latest_data(self, serial, stats=None):
+        """Get the latest reading from a device, keyed by sensor type."""
+
+        data = await self._async_post('getlatestdata', stats,
+                                      serialNumber=serial)
+
+        return _parse_data(data)
+
+    async def async_get_hourly_data(self, serial):
+        """Get the stored hourly readings from a device, in one request."""
+
+        data = await self._async_post('gethourlydata', serialNumber=serial)
+
+        if isinstance(data, dict):
+            data = data.get('data', [data])
+
+        return [_parse_data(item) for item in data if isinstance(item, dict)]
+
+
+def _parse_data(data):
+    """Get the readings in an API response, keyed by sensor type."""
+
+    return {sensor: data.get(field) for sensor, field in API_FIELDS.items()
+            if field in data}
@@ -0,0 +1,35 @@
+"""Fetch statistics for uHoo devices."""
+from .stats import DurationStats
+
+# Histogram bucket bounds, in milliseconds, for a request to the cloud API
+DURATION_BUCKETS = [50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+
+class FetchStats(DurationStats):
+    """API requests for one device, with the body bytes transferred.
+
+    Readings for every device on an account are processed together, so the
+    time spent on the event loop is kept by the account instead.
+    """
+
+    def __init__(self):
+
+        super().__init__(DURATION_BUCKETS)
+        self.throttled = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def record_transfer(self, sent=0, received=0):
+        """Count the body bytes sent to and received from the API."""
+
+        self.bytes_sent += sent
+        self.bytes_received += received
+
+    def as_dict(self):
+
+        data = super().as_dict()
+        data['throttled'] = self.throttled
+        data['bytes_sent'] = self.bytes_sent
+        data['bytes_received'] = self.bytes_received
+
+        return data
@@ -5,20 +5,32 @@ For more details about this platform, please refer to the documentation at
 https://github.com/mcclown/home-assistant-custom-components
 """
 
+import asyncio
 from datetime import timedelta, datetime
 import logging
 import math
+import time
 
 import voluptuous as vol
 
 from homeassistant.const import (
     CONF_EMAIL, CONF_PASSWORD, CONF_DEVICES, DEVICE_CLASS_HUMIDITY,
-    DEVICE_CLASS_TEMPERATURE, TEMP_CELSIUS)
+    DEVICE_CLASS_TEMPERATURE, EVENT_HOMEASSISTANT_STOP, TEMP_CELSIUS)
+from homeassistant.core import callback
 from homeassistant.exceptions import PlatformNotReady
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.dispatcher import (
+    async_dispatcher_connect, async_dispatcher_send)
 from homeassistant.helpers.entity import Entity
-from homeassistant.util import Throttle, dt
+from homeassistant.helpers.event import async_track_point_in_utc_time
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt, slugify
+
+from .backfill import UhooBackfill
+from .client import UhooClient, UhooError
+from .diagnostics import FetchStats
+from .stats import DiagnosticsView, DurationSensor
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -29,6 +41,16 @@ ATTR_COMPONENT = 'component'
 ATTR_VALUE = 'value'
 ATTR_SENSORS = 'sensors'
 
+SIGNAL_UPDATE_UHOO = 'uhooair_update_{}'
+DATA_DIAGNOSTICS = 'uhooair_diagnostics'
+
+# Devices found on each account, and their sensors, are stored so a restart
+# can create the sensors without waiting for the API. One file per account,
+# as each account is a separate platform and would save over the others.
+STORAGE_KEY = 'uhooair.{}'
+LEGACY_STORAGE_KEY = 'uhooair'
+STORAGE_VERSION = 1
+
 DEVICE_CLASS_PM2_5 = 'PM2.5'
 DEVICE_CLASS_CARBON_DIOXIDE = 'Carbon Dioxide'
 DEVICE_CLASS_CARBON_MONOXIDE = 'Carbon Monoxide'
@@ -67,9 +89,17 @@ SENSOR_TYPES = {
               'icon': 'mdi:cloud'},
 }
 
-# This is the minimum time between throttled update calls.
-# Don't bother asking us for state more often than that.
-SCAN_INTERVAL = timedelta(minutes=5)
+# The API only has new data every 15 minutes, so each device is fetched just
+# after its next reading is due, rather than on a fixed interval.
+DATA_INTERVAL = timedelta(minutes=15)
+DATA_GRACE = timedelta(seconds=30)
+
+# When a reading isn't there yet, try again after 1, 2, 4... minutes
+RETRY_MIN_INTERVAL = timedelta(minutes=1)
+RETRY_MAX_INTERVAL = timedelta(minutes=15)
+
+# Readings older than this mark the device as unavailable
+MAX_READING_AGE = timedelta(minutes=60)
 
 #UHOOAIR_DEVICE_SCHEMA = vol.Schema({
 #    vol.Required(CONF_SERIAL_NUMBER): cv.string,
@@ -85,32 +115,98 @@ PLATFORM_SCHEMA = cv.PLATFORM_SCHEMA.extend({
 async def async_setup_platform(hass, config, async_add_entities,
                                discovery_info=None):
     """Connect to the uHoo API and find devices."""
-    from pyuhooair.auth import UhooAuth
-    from pyuhooair.data import get_all_devices
-    from pyuhooair.objects import UhooDev
 
-    auth = UhooAuth(config[CONF_EMAIL], config[CONF_PASSWORD])
+    email = config[CONF_EMAIL]
+    client = UhooClient(async_get_clientsession(hass),
+                        email, config[CONF_PASSWORD])
+    backfill = UhooBackfill(hass, client, email, SENSOR_TYPES)
+    await backfill.async_load()
+    account = UhooAccount(hass, client, email, backfill)
 
-    try:
-        all_devices = []
-        devices = get_all_devices(auth)
+    if DATA_DIAGNOSTICS not in hass.data:
+        hass.data[DATA_DIAGNOSTICS] = {}
+        hass.http.register_view(
+            DiagnosticsView('uhooair', hass.data[DATA_DIAGNOSTICS]))
 
-        for device in devices:
+    hass.data[DATA_DIAGNOSTICS][email] = account
+
+    store = Store(hass, STORAGE_VERSION, STORAGE_KEY.format(slugify(email)))
+    cached_devices = await store.async_load()
+
+    # Devices were stored in one file shared by every account, before
+    if cached_devices is None:
+        legacy = await Store(
+            hass, STORAGE_VERSION, LEGACY_STORAGE_KEY).async_load() or {}
+        cached_devices = legacy.get(email, [])
+    known_devices = {}
+
+    async def async_update_devices():
+        """Fetch the device list, then add sensors for any new devices."""
+
+        devices = await client.async_get_devices()
+        new_devices = [device for device in devices
+                       if device["serialNumber"] not in known_devices]
+
+        if new_devices:
+            account.add_devices(new_devices)
+            await account.async_refresh()
+
+        for device in new_devices:
+            _LOGGER.debug("Found uHoo device: %s", device["deviceName"])
+
+            reading = account.readings.get(device["serialNumber"])
+
+            if reading is None:
+                continue
+
+            known_devices[device["serialNumber"]] = {
+                "serialNumber": device["serialNumber"],
+                "deviceName": device["deviceName"],
+                "sensors": [sensor for sensor in SENSOR_TYPES
+                            if sensor in reading.values]
+            }
+
+            async_add_entities(_create_sensors(
+                account, [known_devices[device["serialNumber"]]]))
+
+            # Import any readings from before the device was added
+            backfill.add_devices([known_devices[device["serialNumber"]]])
+            backfill.async_schedule(device["serialNumber"])
+
+        serials = [device["serialNumber"] for device in devices]
+        await store.async_save([known_devices[serial] for serial in serials
+                                if serial in known_devices])
+
+    async def async_background_start():
+        """Take the first reading, then check for changes to the devices."""
 
-            name = device["deviceName"]
-            _LOGGER.debug("Found uHoo device: %s", name)
+        await account.async_refresh()
 
-            # UhooDev class automatically throttles reads to once every 15 min
-            # and caches results in the object. No need for additional
-            # caching data class.
-            uhoo_data = UhooDev(name, auth)
-            
-            for sensor in SENSOR_TYPES:
-                if sensor in uhoo_data._data:
-                    uhoo_sensor = UhooAirSensor(uhoo_data, device, sensor)
-                    all_devices.append(uhoo_sensor)
+        # Import the readings missed while Home Assistant wasn't running
+        for serial in known_devices:
+            backfill.async_schedule(serial)
 
-        async_add_entities(all_devices, True)
+        try:
+            await async_update_devices()
+        except UhooError as err:
+            _LOGGER.warning("Unable to update uHoo device list: %s", err)
+
+    # Known devices are set up straight away, from the stored device list
+    if cached_devices:
+        for device in cached_devices:
+            known_devices[device["serialNumber"]] = device
+
+        account.add_devices(cached_devices)
+        backfill.add_devices(cached_devices)
+        async_add_entities(_create_sensors(account, cached_devices))
+        account.async_start()
+
+        hass.async_create_task(async_background_start())
+        return
+
+    try:
+        await async_update_devices()
+        account.async_start()
         return
     except Exception as e:
         _LOGGER.error("Error: {0}".format(e))
@@ -118,18 +214,35 @@ async def async_setup_platform(hass, config, async_add_entities,
     raise PlatformNotReady
 
 
+def _create_sensors(account, devices):
+    """Create the sensors for the given (stored) devices."""
+
+    sensors = []
+
+    for device in devices:
+        sensors += [UhooAirSensor(account, device, sensor)
+                    for sensor in device["sensors"] if sensor in SENSOR_TYPES]
+        sensors.append(DurationSensor(
+            '{0} refresh time'.format(device['deviceName']),
+            '{0}_refresh_time'.format(device['serialNumber']),
+            account.stats[device['serialNumber']], account.update_signal))
+
+    return sensors
+
+
 class UhooAirSensor(Entity):
     """Implementation of a uHooAir device."""
 
-    def __init__(self, data, device, sensor_type):
+    def __init__(self, account, device, sensor_type):
         """Initialize the sensor."""
         self._uuid = device["serialNumber"]
         self._device_class = SENSOR_TYPES[sensor_type]['device_class']
         self._name = '{0} {1}'.format(device['deviceName'], self._device_class)
         unit = SENSOR_TYPES[sensor_type]['unit_of_measurement']
         self._unit_of_measurement = unit
-        self._data = data
+        self._account = account
         self._type = sensor_type
+        self._unsub_dispatcher = None
 
     @property
     def name(self):
@@ -149,7 +262,12 @@ class UhooAirSensor(Entity):
     @property
     def state(self):
         """Return the state of the device."""
-        return self._data.get_state(self._type)
+        reading = self._account.readings.get(self._uuid)
+
+        if reading is None:
+            return None
+
+        return reading.values.get(self._type)
 
     @property
     def device_state_attributes(self):
@@ -160,13 +278,12 @@ class UhooAirSensor(Entity):
     def available(self):
         """Device availability based on the last update timestamp."""
 
-        last_api_read = self._data.get_state("DateTime")
+        reading = self._account.readings.get(self._uuid)
 
-        p_time = dt.parse_datetime(last_api_read)
+        if reading is None or reading.updated is None:
+            return False
 
-        #p_time = datetime.strptime(last_api_read, "%Y-%m-%d %H:%M")
-
-        return (dt.utcnow() - dt.as_utc(p_time)) < (timedelta(minutes=60))
+        return (dt.utcnow() - reading.updated) < MAX_READING_AGE
 
     @property
     def unique_id(self):
@@ -180,6 +297,230 @@ class UhooAirSensor(Entity):
 
     @property
     def should_poll(self):
-        """Should device be polled"""
-        return True
+        """No polling needed, readings are pushed by the account"""
+        return False
+
+    async def async_added_to_hass(self):
+        """Subscribe to new readings."""
+        self._unsub_dispatcher = async_dispatcher_connect(
+            self.hass, self._account.update_signal, self._handle_update)
+
+    async def async_will_remove_from_hass(self):
+        """Unsubscribe from new readings."""
+        if self._unsub_dispatcher is not None:
+            self._unsub_dispatcher()
+            self._unsub_dispatcher = None
+
+    @callback
+    def _handle_update(self):
+        """Write the new reading to the state machine."""
+        self.async_schedule_update_ha_state()
+
+
+class UhooReading:
+    """Latest reading from a device, parsed once when it is fetched."""
+
+    __slots__ = ('values', 'updated')
+
+    def __init__(self, data):
+        """Parse the data returned by the API."""
+        self.values = {sensor: data[sensor] for sensor in SENSOR_TYPES
+                       if sensor in data}
+        self.updated = None
+
+        if data.get('DateTime'):
+            p_time = dt.parse_datetime(data['DateTime'])
+
+            if p_time is not None:
+                self.updated = dt.as_utc(p_time)
+
+
+class UhooAccount:
+    """Get the latest data for all devices on a uHoo account.
+
+    One refresh fetches every device, then pushes the parsed readings to all
+    of the sensors. All requests are made here, so reading the entity state
+    never does I/O.
+    """
+
+    def __init__(self, hass, client, email, backfill=None):
+        """Initialize the account."""
+        self.readings = {}
+        self._hass = hass
+        self._client = client
+        self._email = email
+        self._backfill = backfill
+        self._serials = []
+        self._failed = set()
+        self.stats = {}
+        self.blocked = 0.0
+        self._next_fetch = {}
+        self._retries = {}
+        self._started = False
+        self._unsub_refresh = None
+
+    def add_devices(self, devices):
+        """Include more devices in each refresh."""
+        for device in devices:
+            if device["serialNumber"] not in self._serials:
+                self._serials.append(device["serialNumber"])
+                self.stats[device["serialNumber"]] = FetchStats()
+
+    def diagnostics(self):
+        """Get the fetch statistics for the account and each device."""
+
+        return {
+            'blocked_ms': round(self.blocked * 1000, 1),
+            'next_fetch': {serial: when.isoformat()
+                           for serial, when in self._next_fetch.items()},
+            'devices': {serial: stats.as_dict()
+                        for serial, stats in self.stats.items()}
+        }
+
+    @property
+    def update_signal(self):
+        """Dispatcher signal sent after each refresh of this account."""
+        return SIGNAL_UPDATE_UHOO.format(self._email)
+
+    def async_start(self):
+        """Refresh each device as its data is due, until Home Assistant stops."""
+
+        self._started = True
+        self._hass.bus.async_listen_once(
+            EVENT_HOMEASSISTANT_STOP, self._async_handle_stop)
+        self._async_schedule_refresh()
+
+    @callback
+    def _async_schedule_refresh(self):
+        """Wake up for the device whose data is due first."""
+
+        if self._unsub_refresh is not None:
+            self._unsub_refresh()
+            self._unsub_refresh = None
+
+        if not self._started or not self._next_fetch:
+            return
+
+        self._unsub_refresh = async_track_point_in_utc_time(
+            self._hass, self._async_handle_refresh,
+            min(self._next_fetch.values()))
+
+    async def _async_handle_refresh(self, now):
+
+        self._unsub_refresh = None
+        now = dt.utcnow()
+        due = []
+
+        for serial in self._serials:
+            if self._next_fetch.get(serial, now) <= now:
+                due.append(serial)
+            else:
+                self.stats[serial].throttled += 1
+
+        await self.async_refresh(due)
+
+    async def _async_handle_stop(self, event):
+
+        self._started = False
+
+        if self._unsub_refresh is not None:
+            self._unsub_refresh()
+            self._unsub_refresh = None
+
+    def _plan_next_fetch(self, serial, reading, now):
+        """Get the time to fetch the device again, after a reading.
+
+        New data is expected one interval after the last, so the next fetch
+        is made just after then. If there was no new data, or the request
+        failed, back off until it arrives.
+        """
+
+        previous = self.readings.get(serial)
+
+        if reading is not None and reading.updated is not None and \
+                (previous is None or previous.updated != reading.updated):
+            self._retries[serial] = 0
+            expected = reading.updated + DATA_INTERVAL + DATA_GRACE
+
+            if expected > now:
+                return expected
+
+        retries = self._retries.get(serial, 0)
+        self._retries[serial] = retries + 1
+
+        return now + min(RETRY_MIN_INTERVAL * 2 ** min(retries, 4),
+                         RETRY_MAX_INTERVAL)
+
+    async def async_refresh(self, serials=None):
+        """Get the latest data for the devices, then notify the sensors.
+
+        :param serials: the devices to fetch, all of them by default
+        """
+
+        if serials is None:
+            serials = list(self._serials)
+
+        now = dt.utcnow()
+
+        # Fallback, in case the refresh fails part way through
+        for serial in serials:
+            self._next_fetch[serial] = now + DATA_INTERVAL
+
+        try:
+            # The API has no call for several devices at once, so fetch them
+            # all concurrently within the one refresh.
+            results = await asyncio.gather(*[
+                self._async_fetch(serial) for serial in serials],
+                return_exceptions=True)
+
+            start = time.monotonic()
+
+            for serial, result in zip(serials, results):
+
+                if isinstance(result, UhooError):
+                    _LOGGER.error("Unable to update uHoo device %s: %s",
+                                  serial, result)
+                    self._failed.add(serial)
+                    self._next_fetch[serial] = self._plan_next_fetch(
+                        serial, None, now)
+                    continue
+
+                if isinstance(result, Exception):
+                    raise result
+
+                # Import the readings missed while the API was unreachable
+                if serial in self._failed:
+                    self._failed.discard(serial)
+
+                    if self._backfill is not None:
+                        self._backfill.async_schedule(serial)
+
+                reading = UhooReading(result)
+                self._next_fetch[serial] = self._plan_next_fetch(
+                    serial, reading, now)
+                self.readings[serial] = reading
+
+            _LOGGER.debug("Next uHoo refresh for %s due at %s", self._email,
+                          min(self._next_fetch.values(), default=None))
+        finally:
+            self._async_schedule_refresh()
+
+        async_dispatcher_send(self._hass, self.update_signal)
+
+        self.blocked += time.monotonic() - start
+
+    async def _async_fetch(self, serial):
+        """Get the latest data for one device, timing the request."""
+
+        stats = self.stats[serial]
+        start = time.monotonic()
+
+        try:
+            result = await self._client.async_get_latest_data(serial, stats)
+        except UhooError as err:
+            stats.record_failure(time.monotonic() - start, err)
+            raise
+
+        stats.record_success(time.monotonic() - start)
 
+        return result
@@ -0,0 +1,210 @@
+"""Call timings, and the diagnostic sensor and view built on them.
+
+Kept identical in each component, as they are installed separately and
+can't import from each other, and checked by the shared modules workflow.
+Change all three copies together. Anything specific to a component goes
+in its diagnostics module.
+"""
+import bisect
+
+from homeassistant.components.http import HomeAssistantView
+from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.entity import Entity
+from homeassistant.util import dt
+
+UNIT_MILLISECONDS = 'ms'
+
+
+class DurationStats:
+    """Success and failure counts, and a histogram of call durations.
+
+    Durations are kept as fixed buckets and a running total, so recording a
+    call costs the same however long the component has been running.
+    """
+
+    def __init__(self, buckets):
+        """Initialise the statistics.
+
+        :param buckets: upper bounds of the histogram buckets, in
+            milliseconds, anything slower goes into a final overflow bucket
+        """
+
+        self.successes = 0
+        self.failures = 0
+        self.last_duration = None
+        self.last_error = None
+        self.last_error_time = None
+        self._buckets = buckets
+        self._total_duration = 0.0
+        self._histogram = [0] * (len(buckets) + 1)
+
+    @property
+    def mean_duration(self):
+        """Average call duration, in seconds"""
+
+        count = self.successes + self.failures
+
+        if count == 0:
+            return None
+
+        return self._total_duration / count
+
+    def record_success(self, duration):
+
+        self.successes += 1
+        self._record_duration(duration)
+
+    def record_failure(self, duration, err):
+
+        self.failures += 1
+        self.last_error = str(err) or type(err).__name__
+        self.last_error_time = dt.utcnow()
+        self._record_duration(duration)
+
+    def _record_duration(self, duration):
+
+        self.last_duration = duration
+        self._total_duration += duration
+        self._histogram[bisect.bisect_left(
+            self._buckets, duration * 1000)] += 1
+
+    def as_dict(self):
+        """Get the statistics, in a form that can be dumped as JSON"""
+
+        mean = self.mean_duration
+
+        return {
+            'successes': self.successes,
+            'failures': self.failures,
+            'last_duration_ms': None if self.last_duration is None
+                                else round(self.last_duration * 1000, 1),
+            'mean_duration_ms': None if mean is None
+                                else round(mean * 1000, 1),
+            'last_error': self.last_error,
+            'last_error_time': None if self.last_error_time is None
+                               else self.last_error_time.isoformat(),
+            'duration_histogram_ms': {
+                ('<={}'.format(bound) if bound is not None else 'more'): count
+                for bound, count in zip(self._buckets + [None],
+                                        self._histogram)}
+        }
+
+
+class DurationSensor(Entity):
+    """Diagnostic sensor, with the mean call duration for a device.
+
+    The mean is rounded to two significant figures, and state is only
+    written when that changes or a call fails. The other statistics are
+    attributes, as they were at the last write.
+    """
+
+    def __init__(self, name, unique_id, stats, update_signal):
+
+        self._name = name
+        self._unique_id = unique_id
+        self._stats = stats
+        self._update_signal = update_signal
+        self._state = None
+        self._failures = None
+        self._attributes = {}
+        self._unsub_dispatcher = None
+
+    @property
+    def name(self):
+
+        return self._name
+
+    @property
+    def should_poll(self):
+
+        return False
+
+    @property
+    def state(self):
+
+        return self._state
+
+    @property
+    def icon(self):
+
+        return 'mdi:timer-outline'
+
+    @property
+    def unit_of_measurement(self):
+
+        return UNIT_MILLISECONDS
+
+    @property
+    def unique_id(self):
+
+        return self._unique_id
+
+    @property
+    def device_state_attributes(self):
+
+        return self._attributes
+
+    async def async_added_to_hass(self):
+        """Read the statistics, then follow the updates of the device"""
+
+        self._update_from_stats()
+        self._unsub_dispatcher = async_dispatcher_connect(
+            self.hass, self._update_signal, self._handle_update)
+
+    async def async_will_remove_from_hass(self):
+
+        if self._unsub_dispatcher is not None:
+            self._unsub_dispatcher()
+            self._unsub_dispatcher = None
+
+    @callback
+    def _handle_update(self):
+
+        if self._update_from_stats():
+            self.async_schedule_update_ha_state()
+
+    def _update_from_stats(self):
+        """Read the statistics, returns True if state should be written"""
+
+        mean = self._stats.mean_duration
+
+        if mean is None:
+            return False
+
+        state = float('{:.2g}'.format(mean * 1000))
+
+        if (state, self._stats.failures) == (self._state, self._failures):
+            return False
+
+        self._state = state
+        self._failures = self._stats.failures
+        self._attributes = self._stats.as_dict()
+        del self._attributes['duration_histogram_ms']
+
+        return True
+
+
+class DiagnosticsView(HomeAssistantView):
+    """Download the diagnostics of every device of a component, as JSON"""
+
+    def __init__(self, domain, devices):
+        """Initialise the view.
+
+        :param devices: dictionary of objects with a ``diagnostics()``
+            method, keyed by how they are identified in the dump
+        """
+
+        self.url = '/api/{}/diagnostics'.format(domain)
+        self.name = 'api:{}:diagnostics'.format(domain)
+        self._domain = domain
+        self._devices = devices
+
+    async def get(self, request):
+
+        return self.json(
+            {key: device.diagnostics()
+             for key, device in self._devices.items()},
+            headers={'Content-Disposition':
+                     'attachment; filename={}_diagnostics.json'.format(
+                         self._domain)})